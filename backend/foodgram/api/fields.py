@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from rest_framework import serializers
+
+
+class RecipeImageField(Base64ImageField):
+    default_error_messages = {
+        "too_large": "Размер изображения не должен превышать {max_size} байт.",
+        "too_many_pixels": (
+            "Изображение не должно содержать больше {max_pixels} пикселей."
+        ),
+    }
+
+    def to_internal_value(self, data):
+        size = 0
+        if isinstance(data, UploadedFile):
+            size = data.size
+        elif isinstance(data, str):
+            # Every 4 base64 characters decode into 3 bytes, so the size is
+            # checked before anything is decoded.
+            size = len(data.partition(";base64,")[2] or data) // 4 * 3
+        if size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail("too_large", max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+        if isinstance(data, UploadedFile):
+            # Multipart uploads are streamed by the upload handlers and
+            # skip the base64 decoding.
+            file = serializers.ImageField.to_internal_value(self, data)
+        else:
+            file = super().to_internal_value(data)
+        width, height = file.image.size
+        if width * height > settings.IMAGE_MAX_PIXELS:
+            self.fail("too_many_pixels", max_pixels=settings.IMAGE_MAX_PIXELS)
+        return file
+
+
+class ImageRenditionsField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        renditions = recipe.image_renditions
+        if renditions.get("source") != recipe.image.name:
+            renditions = {}
+        request = self.context.get("request")
+        urls = {}
+        for name in settings.IMAGE_RENDITIONS:
+            path = renditions.get(name, recipe.image.name)
+            if not path:
+                urls[name] = None
+                continue
+            url = recipe.image.storage.url(path)
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
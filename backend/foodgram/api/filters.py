@@ -1,39 +1,102 @@
+from django.db import connections
+from django.db.models import (Case, Exists, IntegerField, OuterRef, Value,
+                              When)
+from django.db.models.functions import Collate, Lower
 from django_filters.rest_framework import filters, FilterSet
-from rest_framework.filters import SearchFilter
+from rest_framework.filters import BaseFilterBackend
 
-from recipes.models import Ingredient, Recipe, Tag
+from api.ingredient_index import ingredient_index
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
 
 
-class SearchIngredientFilter(SearchFilter):
+class SearchIngredientFilter(BaseFilterBackend):
     search_param = "name"
+    min_substring_length = 3
+    use_index = True
 
-    class Meta:
-        model = Ingredient
-        fields = ("name",)
+    def filter_queryset(self, request, queryset, view):
+        name = request.query_params.get(self.search_param, "").strip()
+        if not name or view.action != "list":
+            return queryset
+        if self.use_index:
+            return ingredient_index.search(
+                name, view.autocomplete_limit, self.min_substring_length
+            )
+        return self.search_database(queryset, name, view.autocomplete_limit)
+
+    def search_database(self, queryset, name, limit):
+        if len(name) < self.min_substring_length:
+            queryset = queryset.filter(name__istartswith=name)
+        else:
+            queryset = queryset.filter(name__icontains=name)
+        return queryset.annotate(
+            rank=Case(
+                When(name__istartswith=name, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by("rank", self.name_order(queryset), "pk")[:limit]
+
+    def name_order(self, queryset):
+        # The in-memory index sorts lowercased names by code point, so the
+        # database compares them the same way instead of by locale.
+        order = Lower("name")
+        if connections[queryset.db].vendor == "postgresql":
+            order = Collate(order, "C")
+        return order
 
 
 class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         to_field_name="slug",
-        field_name="tags__slug",
         queryset=Tag.objects.all(),
+        method="filter_tags",
     )
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(method='filter_shopping_cart')
+    search = filters.CharFilter(method="filter_search")
+    ordering = filters.ChoiceFilter(
+        choices=(("popular", "Популярные"), ("trending", "Набирающие")),
+        method="filter_ordering",
+    )
+    rankings = {"popular": "popularity", "trending": "trending"}
 
     class Meta:
         model = Recipe
         fields = ("is_in_shopping_cart", "is_favorited", "author", "tags")
 
+    def filter_tags(self, queryset, name, value):
+        if not value:
+            return queryset
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef("pk"), tag__in=value
+        )))
+
     def filter_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value and self.request.user.is_authenticated:
-            return queryset.filter(carts__user=user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef("pk")
+            )))
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and self.request.user.is_authenticated:
-            return queryset.filter(favorites__user=user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef("pk")
+            )))
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return queryset.search(value).order_by(
+            "-search_rank", "-pub_date", "-id"
+        )
+
+    def filter_ordering(self, queryset, name, value):
+        return queryset.filter(score__isnull=False).order_by(
+            f"-score__{self.rankings[value]}", "-score__recipe_id"
+        )
@@ -0,0 +1,92 @@
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice
+from threading import Lock
+from time import monotonic
+
+from django.conf import settings
+
+from foodgram.caching import INGREDIENTS_NAMESPACE, get_version
+from recipes.models import Ingredient
+
+
+def trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class IngredientIndex:
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._checked_at = None
+        self._data = ([], [], {})
+
+    def expire(self):
+        self._checked_at = None
+
+    def _build(self):
+        # The shared version is looked up at most once per interval, changes
+        # made by this process expire the index right away.
+        checked_at = self._checked_at
+        if (checked_at is not None and monotonic() - checked_at
+                < settings.INGREDIENT_INDEX_CHECK_INTERVAL):
+            return
+        version = get_version(INGREDIENTS_NAMESPACE)
+        if version == self._version:
+            self._checked_at = monotonic()
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            rows = sorted(
+                (name.lower(), pk, name, unit)
+                for pk, name, unit in Ingredient.objects.values_list(
+                    "pk", "name", "measurement_unit"
+                ).iterator()
+            )
+            keys = [row[0] for row in rows]
+            ingredients = [
+                Ingredient(pk=pk, name=name, measurement_unit=unit)
+                for _, pk, name, unit in rows
+            ]
+            positions = defaultdict(list)
+            for position, key in enumerate(keys):
+                for trigram in trigrams(key):
+                    positions[trigram].append(position)
+            self._data = (keys, ingredients, dict(positions))
+            self._version = version
+            self._checked_at = monotonic()
+
+    def search(self, name, limit, min_substring_length=3):
+        self._build()
+        keys, ingredients, positions = self._data
+        prefix = name.lower()
+        start = bisect_left(keys, prefix)
+        end = start
+        while (end < len(keys) and end - start < limit
+               and keys[end].startswith(prefix)):
+            end += 1
+        result = ingredients[start:end]
+        if len(result) < limit and len(prefix) >= min_substring_length:
+            # Only names sharing the rarest trigram of the query can contain
+            # it, and the positions keep the order of the index.
+            candidates = range(len(keys))
+            if len(prefix) >= 3:
+                candidates = min(
+                    (positions.get(trigram, ()) for trigram in
+                     trigrams(prefix)),
+                    key=len,
+                )
+            result.extend(islice(
+                (
+                    ingredients[position]
+                    for position in candidates
+                    if prefix in keys[position]
+                    and not keys[position].startswith(prefix)
+                ),
+                limit - len(result),
+            ))
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,47 @@
+import random
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.filters import SearchIngredientFilter
+from api.ingredient_index import ingredient_index
+from api.views import IngredientViewSet
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = ("Сравнивает поиск ингредиентов по индексу в памяти "
+            "с поиском через ORM.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list("name", flat=True))
+        if not names:
+            raise CommandError("Сначала загрузите ингредиенты.")
+        rng = random.Random(options["seed"])
+        queries = [
+            name[:rng.randint(1, min(len(name), 6))]
+            for name in rng.choices(names, k=options["queries"])
+        ]
+        limit = IngredientViewSet.autocomplete_limit
+        search_filter = SearchIngredientFilter()
+        queryset = Ingredient.objects.all()
+        ingredient_index.search("", limit)
+        paths = (
+            ("index", lambda name: ingredient_index.search(name, limit)),
+            ("orm", lambda name: list(
+                search_filter.search_database(queryset, name, limit)
+            )),
+        )
+        for label, search in paths:
+            started = perf_counter()
+            for name in queries:
+                search(name)
+            elapsed = perf_counter() - started
+            self.stdout.write(
+                f"{label}: {elapsed * 1000:.1f} мс на {len(queries)} "
+                f"запросов, {elapsed / len(queries) * 1e6:.0f} мкс/запрос"
+            )
@@ -0,0 +1,103 @@
+from hashlib import md5
+from time import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework import status
+
+from foodgram.caching import get_version
+
+
+class CachedResponseMixin:
+    cache_namespace = None
+    cached_formats = ("json",)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_response_cache_key(self, request):
+        path = md5(request.get_full_path().encode("utf-8")).hexdigest()
+        return "response:{}:{}:{}:{}".format(
+            self.cache_namespace,
+            get_version(self.cache_namespace),
+            request.accepted_renderer.format,
+            path,
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format not in self.cached_formats:
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            response = self.finalize_response(
+                request, handler(request, *args, **kwargs), *args, **kwargs
+            )
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            response.render()
+            entry = {
+                "content": response.content,
+                "content_type": response["Content-Type"],
+                "etag": quote_etag(md5(response.content).hexdigest()),
+                "last_modified": int(time()),
+            }
+            cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+        response = HttpResponse(
+            entry["content"], content_type=entry["content_type"]
+        )
+        response["ETag"] = entry["etag"]
+        response["Last-Modified"] = http_date(entry["last_modified"])
+        return get_conditional_response(
+            request._request,
+            etag=entry["etag"],
+            last_modified=entry["last_modified"],
+            response=response,
+        )
+
+
+class ConditionalGetMixin:
+    conditional_formats = ("json",)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_list_etag_parts, super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            self.get_object_etag_parts, super().retrieve,
+            request, *args, **kwargs
+        )
+
+    def get_list_etag_parts(self, request):
+        return None
+
+    def get_object_etag_parts(self, request):
+        return None
+
+    def conditional_response(self, get_etag_parts, handler,
+                             request, *args, **kwargs):
+        if request.accepted_renderer.format not in self.conditional_formats:
+            return handler(request, *args, **kwargs)
+        parts = get_etag_parts(request)
+        if parts is None:
+            return handler(request, *args, **kwargs)
+        etag = "W/" + quote_etag(md5(
+            "|".join(map(str, parts)).encode("utf-8")
+        ).hexdigest())
+        response = get_conditional_response(request._request, etag=etag)
+        if response is not None:
+            return response
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response["ETag"] = etag
+        return response
@@ -1,6 +1,192 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import partial
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import BooleanField, Expression, F, Q, Value
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_KEY = "pagination_count:{}"
+
+
+class RowComparison(Expression):
+    conditional = True
+
+    def __init__(self, fields, operator, values):
+        super().__init__(output_field=BooleanField())
+        self.fields = [F(field) for field in fields]
+        self.operator = operator
+        self.cursor = list(values)
+        self.values = []
+
+    def get_source_expressions(self):
+        return self.fields
+
+    def set_source_expressions(self, exprs):
+        self.fields = exprs
+
+    def resolve_expression(self, *args, **kwargs):
+        resolved = super().resolve_expression(*args, **kwargs)
+        # Cursor values are converted by the fields here, so that a broken
+        # cursor fails in filter() and not later during the query.
+        resolved.values = [
+            Value(
+                field.output_field.to_python(value),
+                output_field=field.output_field,
+            )
+            for field, value in zip(resolved.fields, resolved.cursor)
+        ]
+        return resolved
+
+    def as_sql(self, compiler, connection):
+        sides = []
+        params = []
+        for exprs in (self.fields, self.values):
+            compiled = [compiler.compile(expr) for expr in exprs]
+            sides.append(", ".join(sql for sql, _ in compiled))
+            for _, expr_params in compiled:
+                params.extend(expr_params)
+        return f"({sides[0]}) {self.operator} ({sides[1]})", params
+
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, *args, versions=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.versions = versions
+
+    @cached_property
+    def count(self):
+        # Without cache versions bumped on writes a stale count would also
+        # clamp the page slice, so such querysets are counted every time.
+        if self.versions is None or not hasattr(self.object_list, "query"):
+            return super().count
+        queryset = self.object_list.order_by().values("pk")
+        sql, params = queryset.query.sql_with_params()
+        versions = "|".join(map(str, self.versions))
+        key = COUNT_KEY.format(md5(
+            f"{queryset.db}|{versions}|{sql}|{params}".encode("utf-8")
+        ).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = self.estimate_count(queryset, sql, params)
+            if count is None:
+                count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
+
+    def estimate_count(self, queryset, sql, params):
+        threshold = settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+        connection = connections[queryset.db]
+        if not threshold or connection.vendor != "postgresql":
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        rows = plan[0]["Plan"]["Plan Rows"]
+        return rows if rows >= threshold else None
 
 
 class CustomPaginLimitOnPage(PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
     page_size = 6
     page_size_query_param = "limit"
+    cursor_query_param = "cursor"
+    invalid_cursor_message = "Неверный курсор."
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_ordering = None
+        if (self.cursor_query_param in request.query_params
+                or getattr(view, "action", None)
+                in getattr(view, "keyset_actions", ())):
+            get_ordering = getattr(view, "get_keyset_ordering", None)
+            self.keyset_ordering = get_ordering() if get_ordering else None
+        if self.keyset_ordering is None:
+            get_versions = getattr(view, "get_count_versions", None)
+            self.django_paginator_class = partial(
+                CachedCountPaginator,
+                versions=get_versions() if get_versions else None,
+            )
+            return super().paginate_queryset(queryset, request, view)
+        return self.paginate_keyset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset_ordering is None:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict((
+            ("next", self.next_link),
+            ("results", data),
+        )))
+
+    def paginate_keyset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                queryset = queryset.filter(
+                    self.after(self.decode_cursor(cursor))
+                )
+            except (TypeError, ValueError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+        get_page = getattr(view, "get_keyset_page", None)
+        if get_page is None:
+            page = list(
+                queryset.order_by(*self.keyset_ordering)[:page_size + 1]
+            )
+        else:
+            page = get_page(queryset, self.keyset_ordering, page_size + 1)
+        self.next_link = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_link = replace_query_param(
+                request.build_absolute_uri(), self.cursor_query_param,
+                self.encode_cursor(page[-1]),
+            )
+        return page
+
+    def after(self, values):
+        names = [field.lstrip("-") for field in self.keyset_ordering]
+        descending = [field.startswith("-") for field in self.keyset_ordering]
+        if len(set(descending)) == 1:
+            # A row comparison (a, b) < (x, y) is a single range condition
+            # on the composite index, so deep pages start at the cursor.
+            return RowComparison(
+                names, "<" if descending[0] else ">", values
+            )
+        # Mixed directions cannot be compared as a row. The bound on the
+        # leading field keeps the index range, the rest is filtered.
+        condition = Q()
+        equal = Q()
+        for name, desc, value in zip(names, descending, values):
+            lookup = "lt" if desc else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        leading = "lte" if descending[0] else "gte"
+        return Q(**{f"{names[0]}__{leading}": values[0]}) & condition
+
+    def encode_cursor(self, item):
+        values = []
+        for field in self.keyset_ordering:
+            value = item
+            for attr in field.lstrip("-").split("__"):
+                value = getattr(value, attr)
+            values.append(value)
+        # str() keeps the microseconds of datetimes, unlike DjangoJSONEncoder.
+        data = json.dumps(values, default=str).encode("utf-8")
+        return urlsafe_b64encode(data).decode("ascii")
+
+    def decode_cursor(self, cursor):
+        values = json.loads(urlsafe_b64decode(cursor.encode("ascii")))
+        if (not isinstance(values, list)
+                or len(values) != len(self.keyset_ordering)):
+            raise ValueError(cursor)
+        return values
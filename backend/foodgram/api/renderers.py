@@ -0,0 +1,170 @@
+import csv
+import json
+from abc import ABC, abstractmethod
+from itertools import islice
+from textwrap import wrap
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(ABC, BaseRenderer):
+    title = "Купить в магазине:"
+    charset = "utf-8"
+
+    @abstractmethod
+    def stream(self, rows):
+        pass
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+    def stream(self, rows):
+        yield self.title
+        for name, measurement_unit, amount in rows:
+            yield f"\n{name} ({measurement_unit}) - {amount}"
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    header = ("Ингредиент", "Единица измерения", "Количество")
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield "\ufeff" + writer.writerow(self.header)
+        for row in rows:
+            yield writer.writerow(row)
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = "application/json"
+    format = "json"
+
+    def stream(self, rows):
+        separator = "["
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps({
+                "name": name,
+                "measurement_unit": measurement_unit,
+                "amount": amount,
+            }, ensure_ascii=False)
+            separator = ","
+        yield "[]" if separator == "[" else "]"
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = "application/pdf"
+    format = "pdf"
+    charset = None
+    page_width = 595
+    page_height = 842
+    margin = 56
+    font_size = 12
+    leading = 18
+    line_width = 80
+    # Standard Helvetica has no Cyrillic code points, so cp1251 bytes are
+    # mapped to the Adobe glyph names of the Cyrillic letters.
+    encoding = (
+        b"<< /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences "
+        b"[168 /afii10023 184 /afii10071 /afii61352 192 "
+        + b" ".join(b"/afii%d" % code for code in (
+            *range(10017, 10023), *range(10024, 10050),
+            *range(10065, 10071), *range(10072, 10098),
+        ))
+        + b"] >>"
+    )
+
+    def stream(self, rows):
+        document = PDFDocument()
+        yield document.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        yield document.add(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        yield document.add(3, (
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+            b"/Encoding 4 0 R >>"
+        ))
+        yield document.add(4, self.encoding)
+        lines = self.lines(rows)
+        lines_per_page = (self.page_height - 2 * self.margin) // self.leading
+        pages = []
+        number = 5
+        while True:
+            page = list(islice(lines, lines_per_page))
+            if not page and pages:
+                break
+            yield document.add(number, self.content(page))
+            yield document.add(number + 1, (
+                b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                b"/Resources << /Font << /F1 3 0 R >> >> "
+                b"/Contents %d 0 R >>"
+                % (self.page_width, self.page_height, number)
+            ))
+            pages.append(number + 1)
+            number += 2
+        yield document.add(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % page for page in pages), len(pages)
+        ))
+        yield document.close(root=1)
+
+    def lines(self, rows):
+        yield self.title
+        for name, measurement_unit, amount in rows:
+            yield from wrap(
+                f"{name} ({measurement_unit}) - {amount}", self.line_width
+            )
+
+    def content(self, lines):
+        text = b"".join(
+            b"(" + line.encode("cp1251", "replace").replace(
+                b"\\", b"\\\\"
+            ).replace(b"(", b"\\(").replace(b")", b"\\)") + b") Tj T*\n"
+            for line in lines
+        )
+        content = b"BT\n/F1 %d Tf\n%d TL\n%d %d Td\n%sET" % (
+            self.font_size, self.leading, self.margin,
+            self.page_height - self.margin - self.font_size, text
+        )
+        return b"<< /Length %d >>\nstream\n%s\nendstream" % (
+            len(content), content
+        )
+
+
+class PDFDocument:
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+
+    def write(self, data):
+        self.position += len(data)
+        return data
+
+    def add(self, number, body):
+        self.offsets[number] = self.position
+        return self.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+    def close(self, root):
+        size = len(self.offsets) + 1
+        xref = b"".join(
+            b"%010d 00000 n \n" % self.offsets[number]
+            for number in range(1, size)
+        )
+        return (
+            b"xref\n0 %d\n0000000000 65535 f \n%s"
+            b"trailer\n<< /Size %d /Root %d 0 R >>\n"
+            b"startxref\n%d\n%%%%EOF\n"
+            % (size, xref, size, root, self.position)
+        )
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
@@ -1,9 +1,16 @@
+import json
+
+from django.conf import settings
 from django.db import transaction
-from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
+from rest_framework.utils import html
+from rest_framework.validators import UniqueTogetherValidator
 
+from foodgram.caching import invalidate_shopping_lists
+from api.fields import ImageRenditionsField, RecipeImageField
 from api.validators import (validate_cooking_time, validate_tags,
                             validate_ingredients, validate_subscribed)
 
@@ -38,6 +45,8 @@ class UserSerializerCustom(UserSerializer):
     lookup_field = 'username'
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         if user.is_authenticated:
             return Subscription.objects.filter(
@@ -60,10 +69,11 @@ class IngredientSerializer(serializers.ModelSerializer):
 
 class BriefInfoSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    images = ImageRenditionsField()
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "images", "cooking_time")
 
 
 class IngredientAddSerializer(serializers.ModelSerializer):
@@ -87,6 +97,10 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit", "amount")
 
 
+class SubscriptionQuerySerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(min_value=1, required=False)
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
@@ -107,23 +121,27 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         return data
 
     def get_is_subscribed(self, obj):
+        user = self.context["request"].user
+        if obj.user_id == user.id:
+            return True
         return Subscription.objects.filter(
-            user=self.context["request"].user,
+            user=user,
             author=obj.author
         ).exists()
 
     def get_recipes(self, obj):
-        recipes_limit = (
-            self.context["request"].query_params.get("recipes_limit")
-        )
-        queryset = (
-            obj.author.recipes.all()[:int(recipes_limit)] if recipes_limit
-            else obj.author.recipes.all()
-        )
+        if hasattr(obj.author, "recipes_preview"):
+            return BriefInfoSerializer(
+                obj.author.recipes_preview, many=True
+            ).data
+        recipes_limit = self.context.get("recipes_limit")
+        queryset = obj.author.recipes.all()
+        if recipes_limit is not None:
+            queryset = queryset[:recipes_limit]
         return BriefInfoSerializer(queryset, many=True).data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.recipes_count
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
@@ -140,34 +158,59 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         queryset=Tag.objects.all(),
         validators=[validate_tags]
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
         fields = ("id", "author", "ingredients", "tags",
                   "image", "name", "text", "cooking_time")
 
+    def to_internal_value(self, data):
+        if html.is_html_input(data) and isinstance(
+            data.get("ingredients"), str
+        ):
+            # Multipart forms carry the ingredients as a JSON string next to
+            # the image file.
+            data = {
+                key: data.getlist(key) if key == "tags" else data[key]
+                for key in data
+            }
+            try:
+                data["ingredients"] = json.loads(data["ingredients"])
+            except ValueError:
+                raise serializers.ValidationError({
+                    "ingredients": ["Ожидается JSON-список ингредиентов."]
+                })
+        return super().to_internal_value(data)
+
     def validate(self, data):
-        ingredients = data["ingredients"]
-        ingredient_list = []
+        ingredients = data.get("ingredients", [])
+        ingredient_ids = set()
+        duplicates = set()
         for item in ingredients:
-            ingredient = get_object_or_404(
-                Ingredient, id=item["id"]
+            if item["id"] in ingredient_ids:
+                duplicates.add(item["id"])
+            ingredient_ids.add(item["id"])
+        if duplicates:
+            raise serializers.ValidationError(
+                f"Ингредиенты с id {sorted(duplicates)} "
+                f"указаны в рецепте несколько раз."
+            )
+        found = Ingredient.objects.in_bulk(ingredient_ids)
+        missing = ingredient_ids - found.keys()
+        if missing:
+            raise serializers.ValidationError(
+                f"Ингредиенты с id {sorted(missing)} не найдены."
             )
-            if ingredient in ingredient_list:
-                raise serializers.ValidationError(
-                    f"Ингредиент - {ingredient} - уже есть в рецепте."
-                )
-            ingredient_list.append(ingredient)
+        for item in ingredients:
+            item["ingredient"] = found[item["id"]]
         return data
 
     def create_ingredients(self, ingredients, recipe):
         ingredient_list = [
             IngredientRecipe(
                 recipe=recipe,
-                ingredient=get_object_or_404(
-                    Ingredient, id=ingredient.get("id")
-                ),
+                ingredient=ingredient["ingredient"],
                 amount=ingredient.get("amount")
             )
             for ingredient in ingredients
@@ -186,20 +229,54 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         self.create_ingredients(ingredients, recipe)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        current = {
+            item.ingredient_id: item
+            for item in recipe.ingredientrecipe.all()
+        }
+        ingredient_list = []
+        changed = []
+        for ingredient in ingredients:
+            item = current.pop(ingredient["ingredient"].id, None)
+            if item is None:
+                ingredient_list.append(ingredient)
+            elif item.amount != ingredient["amount"]:
+                item.amount = ingredient["amount"]
+                changed.append(item)
+        if current:
+            IngredientRecipe.objects.filter(
+                pk__in=[item.pk for item in current.values()]
+            ).delete()
+        IngredientRecipe.objects.bulk_update(changed, ("amount",))
+        self.create_ingredients(ingredient_list, recipe)
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        instance.tags.clear()
-        tags = validated_data.pop("tags")
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        ingredients = validated_data.pop("ingredients")
-        self.create_ingredients(ingredients, instance)
+        tags = validated_data.pop("tags", None)
+        if tags is not None:
+            instance.tags.set(tags)
+        ingredients = validated_data.pop("ingredients", None)
+        if ingredients is not None:
+            self.update_ingredients(ingredients, instance)
+            invalidate_shopping_lists(instance.carts.values_list(
+                "user_id", flat=True
+            ))
         return super().update(
             instance,
             validated_data
         )
 
     def to_representation(self, instance):
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                "ingredientrecipe",
+                queryset=IngredientRecipe.objects.select_related(
+                    "ingredient"
+                ),
+            ),
+            "tags",
+        )
         return RecipeReadSerializer(
             instance, context=self.context
         ).data
@@ -209,6 +286,7 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     author = UserSerializerCustom(read_only=True)
     tags = TagSerializer(read_only=True, many=True)
     image = Base64ImageField()
+    images = ImageRenditionsField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     ingredients = IngredientRecipeSerializer(
@@ -219,20 +297,29 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
         fields = ("id", "tags", "author", "ingredients", "is_favorited",
-                  "is_in_shopping_cart", "name", "image", "text",
+                  "is_in_shopping_cart", "name", "image", "images", "text",
                   "cooking_time")
 
     def get_ingredients(self, obj):
         ingredients_list = IngredientRecipe.objects.filter(recipe=obj)
         return IngredientRecipeSerializer(ingredients_list, many=True).data
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get("request")
         if request.user.is_authenticated:
             return obj.carts.filter(user=request.user).exists()
         return False
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get("request")
         if request.user.is_authenticated:
             return obj.favorites.filter(user=request.user).exists()
@@ -243,6 +330,13 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShoppingCart
         fields = "__all__"
+        validators = [
+            UniqueTogetherValidator(
+                queryset=ShoppingCart.objects.all(),
+                fields=("user", "recipe"),
+                message="Рецепт уже в корзине покупок."
+            )
+        ]
 
     def to_representation(self, instance):
         return BriefInfoSerializer(
@@ -255,9 +349,59 @@ class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Favorite
         fields = "__all__"
+        validators = [
+            UniqueTogetherValidator(
+                queryset=Favorite.objects.all(),
+                fields=("user", "recipe"),
+                message="Рецепт уже в избранном."
+            )
+        ]
 
     def to_representation(self, instance):
         return BriefInfoSerializer(
             instance.recipe,
             context={"request": self.context.get("request")}
         ).data
+
+
+class BatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_SIZE,
+    )
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+
+    def to_internal_value(self, data):
+        # Both ?ingredients=1&ingredients=2 and ?ingredients=1,2 are accepted.
+        ingredients = [
+            value
+            for item in data.getlist("ingredients")
+            for value in item.split(",") if value
+        ]
+        values = {"ingredients": ingredients}
+        if "max_missing" in data:
+            values["max_missing"] = data["max_missing"]
+        return super().to_internal_value(values)
+
+
+class CookableRecipeSerializer(RecipeReadSerializer):
+    matched_ingredients = serializers.IntegerField(
+        source="ingredients_matched", read_only=True
+    )
+    missing_ingredients = serializers.IntegerField(
+        source="ingredients_missing", read_only=True
+    )
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + (
+            "matched_ingredients", "missing_ingredients"
+        )
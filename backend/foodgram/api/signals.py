@@ -0,0 +1,73 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api.ingredient_index import ingredient_index
+from foodgram.caching import (INGREDIENTS_NAMESPACE, RECIPES_NAMESPACE,
+                              TAGS_NAMESPACE, USERS_NAMESPACE, bump_version,
+                              invalidate_shopping_lists, invalidate_tokens,
+                              shopping_list_namespace, user_flags_namespace)
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Subscription, User
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredients(**kwargs):
+    bump_version(INGREDIENTS_NAMESPACE)
+    ingredient_index.expire()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tags(**kwargs):
+    bump_version(TAGS_NAMESPACE)
+
+
+@receiver((post_save, post_delete), sender=User)
+def invalidate_users(instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    bump_version(USERS_NAMESPACE)
+    # Cached tokens carry the user, so password changes and deactivation
+    # must not be served from a stale copy.
+    invalidate_tokens(Token.objects.filter(user=instance).values_list(
+        "key", flat=True
+    ))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_token(instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipes(action=None, **kwargs):
+    if action is None or action.startswith("post_"):
+        bump_version(RECIPES_NAMESPACE)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def invalidate_cart(instance, **kwargs):
+    bump_version(
+        shopping_list_namespace(instance.user_id),
+        user_flags_namespace(instance.user_id),
+    )
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Subscription)
+def invalidate_user_flags(instance, **kwargs):
+    bump_version(user_flags_namespace(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_recipe_ingredients(instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now()
+    )
+    bump_version(RECIPES_NAMESPACE)
+    invalidate_shopping_lists(ShoppingCart.objects.filter(
+        recipe_id=instance.recipe_id
+    ).values_list("user_id", flat=True))
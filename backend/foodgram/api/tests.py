@@ -0,0 +1,1206 @@
+import base64
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from api.filters import RecipeFilter, SearchIngredientFilter
+from api.ingredient_index import ingredient_index
+from api.pagination import RowComparison
+from api.views import RecipeViewSet
+from foodgram.caching import (INGREDIENTS_NAMESPACE, bump_version,
+                              get_version, user_flags_namespace)
+from foodgram.testing import create_recipe, create_user, create_users
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.renditions import generate_renditions
+from users.models import Subscription
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class RecipeQueryCountTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("reader")
+        authors = create_users("author", 3)
+        tags = [
+            Tag.objects.create(
+                name=f"Тэг {i}", color=f"#00000{i}", slug=f"tag{i}"
+            )
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f"Ингредиент {i}",
+                                      measurement_unit="г")
+            for i in range(5)
+        ]
+        for i in range(12):
+            recipe = create_recipe(authors[i % len(authors)], f"Рецепт {i}")
+            recipe.tags.set(tags[:i % len(tags) + 1])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=i + 1)
+                for ingredient in ingredients[:i % len(ingredients) + 1]
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Subscription.objects.create(user=cls.user, author=authors[0])
+        cls.recipe = Recipe.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_list_query_count_does_not_depend_on_page_size(self):
+        for limit in (1, 6, 12):
+            cache.clear()
+            with self.subTest(limit=limit), self.assertNumQueries(4):
+                response = self.client.get(
+                    "/api/recipes/", {"limit": limit}
+                )
+                self.assertEqual(len(response.data["results"]), limit)
+
+    def test_page_count_cached_per_filter(self):
+        total = Recipe.objects.count()
+        self.client.get("/api/recipes/", {"limit": 1})
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/recipes/", {"page": 2})
+        self.assertEqual(response.data["count"], total)
+        response = self.client.get("/api/recipes/", {"tags": "tag2"})
+        self.assertEqual(
+            response.data["count"],
+            Recipe.objects.filter(tags__slug="tag2").count()
+        )
+
+    def test_page_count_follows_new_recipes(self):
+        total = Recipe.objects.count()
+        self.client.get("/api/recipes/", {"limit": total})
+        recipe = create_recipe(self.user, "Новый рецепт")
+        response = self.client.get("/api/recipes/", {"limit": total + 1})
+        self.assertEqual(response.data["count"], total + 1)
+        self.assertEqual(response.data["results"][0]["id"], recipe.id)
+        self.assertEqual(len(response.data["results"]), total + 1)
+
+    def test_page_count_follows_user_flags(self):
+        params = {"is_favorited": 1, "limit": 100}
+        total = self.client.get("/api/recipes/", params).data["count"]
+        Favorite.objects.create(
+            user=self.user,
+            recipe=Recipe.objects.exclude(favorites__user=self.user).first(),
+        )
+        response = self.client.get("/api/recipes/", params)
+        self.assertEqual(response.data["count"], total + 1)
+        self.assertEqual(len(response.data["results"]), total + 1)
+
+    def test_cursor_pages_follow_feed_without_count(self):
+        Recipe.objects.update(pub_date=timezone.now())
+        expected = list(Recipe.objects.order_by(
+            "-pub_date", "-id"
+        ).values_list("id", flat=True))
+        ids = []
+        url, params = "/api/recipes/", {"limit": 4, "cursor": ""}
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+            self.assertFalse(any(
+                "COUNT(" in query["sql"]
+                for query in context.captured_queries
+            ))
+            self.assertNotIn("count", response.data)
+            ids.extend(recipe["id"] for recipe in response.data["results"])
+            url, params = response.data["next"], None
+        self.assertEqual(ids, expected)
+
+    def test_cursor_is_a_row_comparison(self):
+        response = self.client.get("/api/recipes/", {"limit": 4, "cursor": ""})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(response.data["next"])
+        sql = context.captured_queries[0]["sql"]
+        self.assertIn(
+            '("recipes_recipe"."pub_date", "recipes_recipe"."id") < (', sql
+        )
+        queryset = Recipe.objects.filter(
+            RowComparison(("pub_date", "id"), "<", (timezone.now(), 1))
+        ).order_by("-pub_date", "-id")
+        self.assertIn("recipe_pub_date_id_idx", queryset.explain())
+
+    def test_invalid_cursor(self):
+        for cursor in ("garbage", "WyJ4IiwgMV0="):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(
+                    "/api/recipes/", {"cursor": cursor}
+                )
+                self.assertEqual(response.status_code, 404)
+
+    def test_subscriptions_cursor(self):
+        response = self.client.get(
+            "/api/users/subscriptions/", {"cursor": "", "limit": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+
+    def test_anonymous_list_query_count(self):
+        self.client.force_authenticate(None)
+        with self.assertNumQueries(4):
+            self.client.get("/api/recipes/", {"limit": 12})
+
+    def test_detail_query_count(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/api/recipes/{self.recipe.id}/")
+        self.assertEqual(
+            len(response.data["ingredients"]),
+            self.recipe.ingredientrecipe.count()
+        )
+
+    def test_unchanged_list_and_detail_return_not_modified(self):
+        urls = {"/api/recipes/": 0, f"/api/recipes/{self.recipe.id}/": 1}
+        for url, queries in urls.items():
+            with self.subTest(url=url):
+                etag = self.client.get(url)["ETag"]
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_user_flags_and_recipe(self):
+        url = f"/api/recipes/{self.recipe.id}/"
+        etag = self.client.get(url)["ETag"]
+        Favorite.objects.get_or_create(user=self.user, recipe=self.recipe)
+        Favorite.objects.filter(user=self.user, recipe=self.recipe).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        self.recipe.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_etag_changes_with_recipes(self):
+        url = "/api/recipes/"
+        etag = self.client.get(url)["ETag"]
+        self.recipe.tags.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        Recipe.objects.last().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_etag_follows_cached_page_count(self):
+        url = "/api/recipes/?is_favorited=1"
+        response = self.client.get(url)
+        etag, count = response["ETag"], response.data["count"]
+        Favorite.objects.create(
+            user=self.user,
+            recipe=Recipe.objects.exclude(favorites__user=self.user).first(),
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], count + 1)
+        response = self.client.get(
+            url, HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_flags_match_user_relations(self):
+        response = self.client.get("/api/recipes/", {"limit": 12})
+        favorited = set(
+            self.user.favorites.values_list("recipe_id", flat=True)
+        )
+        in_cart = set(self.user.carts.values_list("recipe_id", flat=True))
+        for item in response.data["results"]:
+            self.assertEqual(item["is_favorited"], item["id"] in favorited)
+            self.assertEqual(
+                item["is_in_shopping_cart"], item["id"] in in_cart
+            )
+            self.assertEqual(
+                item["author"]["is_subscribed"],
+                item["author"]["username"] == "author0"
+            )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeCreateTest(APITestCase):
+    image = (
+        "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAf"
+        "FcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("author")
+        cls.tag = Tag.objects.create(name="Тэг", slug="tag")
+        cls.ingredients = [
+            Ingredient.objects.create(name=f"Ингредиент {i}",
+                                      measurement_unit="г")
+            for i in range(30)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients):
+        return {
+            "name": "Рецепт", "text": "Описание", "cooking_time": 10,
+            "tags": [self.tag.id], "image": self.image,
+            "ingredients": ingredients,
+        }
+
+    def test_missing_ingredients_reported_in_one_error(self):
+        response = self.client.post("/api/recipes/", self.payload([
+            {"id": self.ingredients[0].id, "amount": 1},
+            {"id": 100500, "amount": 1},
+            {"id": 100501, "amount": 1},
+        ]), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("[100500, 100501]", str(response.data))
+
+    def test_duplicate_ingredients_rejected(self):
+        ingredient_id = self.ingredients[0].id
+        response = self.client.post("/api/recipes/", self.payload([
+            {"id": ingredient_id, "amount": 1},
+            {"id": ingredient_id, "amount": 2},
+        ]), format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_query_count_does_not_depend_on_ingredients(self):
+        query_counts = []
+        for count in (1, len(self.ingredients)):
+            ingredients = [
+                {"id": ingredient.id, "amount": 2}
+                for ingredient in self.ingredients[:count]
+            ]
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(
+                    "/api/recipes/", self.payload(ingredients), format="json"
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data["ingredients"]), count)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_update_touches_only_changed_ingredients(self):
+        response = self.client.post("/api/recipes/", self.payload([
+            {"id": ingredient.id, "amount": 1}
+            for ingredient in self.ingredients[:3]
+        ]), format="json")
+        recipe_id = response.data["id"]
+        before = dict(IngredientRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list("ingredient_id", "id"))
+        response = self.client.patch(
+            f"/api/recipes/{recipe_id}/", self.payload([
+                {"id": self.ingredients[0].id, "amount": 1},
+                {"id": self.ingredients[1].id, "amount": 5},
+                {"id": self.ingredients[3].id, "amount": 1},
+            ]), format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        after = {
+            item.ingredient_id: item
+            for item in IngredientRecipe.objects.filter(recipe_id=recipe_id)
+        }
+        self.assertEqual(set(after), {
+            self.ingredients[0].id, self.ingredients[1].id,
+            self.ingredients[3].id,
+        })
+        for ingredient in self.ingredients[:2]:
+            self.assertEqual(after[ingredient.id].id, before[ingredient.id])
+        self.assertEqual(after[self.ingredients[1].id].amount, 5)
+        self.assertEqual(
+            {item["amount"] for item in response.data["ingredients"]}, {1, 5}
+        )
+
+
+class IngredientSearchTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("тростниковый сахар", "сахар", "сахарная пудра",
+                         "соль", "сало")
+        )
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.expire()
+
+    def test_prefix_matches_ranked_before_substring_matches(self):
+        response = self.client.get("/api/ingredients/", {"name": "сахар"})
+        self.assertEqual(
+            [item["name"] for item in response.json()],
+            ["сахар", "сахарная пудра", "тростниковый сахар"]
+        )
+
+    def test_short_query_matches_prefix_only(self):
+        response = self.client.get("/api/ingredients/", {"name": "са"})
+        self.assertEqual(
+            [item["name"] for item in response.json()],
+            ["сало", "сахар", "сахарная пудра"]
+        )
+
+    def test_index_rebuilt_after_ingredient_changes(self):
+        self.client.get("/api/ingredients/", {"name": "сол"})
+        Ingredient.objects.create(name="солод", measurement_unit="г")
+        Ingredient.objects.get(name="соль").delete()
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/ingredients/", {"name": "сол"})
+        self.assertEqual(
+            [item["name"] for item in response.json()], ["солод"]
+        )
+        with self.assertNumQueries(0):
+            self.client.get("/api/ingredients/", {"name": "сал"})
+
+    def test_index_and_database_order_agree(self):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("Tofu", "tahini", "Matcha tea", "green tea")
+        )
+        for name in ("t", "tea"):
+            with self.subTest(name=name):
+                indexed = ingredient_index.search(name, 20)
+                found = SearchIngredientFilter().search_database(
+                    Ingredient.objects.all(), name, 20
+                )
+                self.assertEqual(
+                    [item.name for item in indexed],
+                    [item.name for item in found]
+                )
+        self.assertEqual(
+            [item.name for item in indexed], ["green tea", "Matcha tea"]
+        )
+
+    def test_shared_version_checked_once_per_interval(self):
+        ingredient_index.search("сол", 20)
+        Ingredient.objects.bulk_create(
+            [Ingredient(name="солод", measurement_unit="г")]
+        )
+        bump_version(INGREDIENTS_NAMESPACE)
+        with self.assertNumQueries(0):
+            result = ingredient_index.search("сол", 20)
+        self.assertEqual([item.name for item in result], ["соль"])
+        with override_settings(INGREDIENT_INDEX_CHECK_INTERVAL=0):
+            result = ingredient_index.search("сол", 20)
+        self.assertEqual(
+            [item.name for item in result], ["солод", "соль"]
+        )
+
+
+class ShoppingListDownloadTest(APITestCase):
+    url = "/api/recipes/download_shopping_cart/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("buyer")
+        sugar = Ingredient.objects.create(name="сахар", measurement_unit="г")
+        salt = Ingredient.objects.create(name="соль", measurement_unit="г")
+        for amount in (10, 20):
+            recipe = create_recipe(cls.user, f"Рецепт {amount}")
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=sugar, amount=amount
+            )
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=salt, amount=5
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def download(self, file_format=None):
+        params = {"format": file_format} if file_format else {}
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode("utf-8")
+
+    def test_text_is_default_format(self):
+        self.assertEqual(
+            self.download(),
+            "Купить в магазине:\nсахар (г) - 30\nсоль (г) - 5"
+        )
+
+    def test_csv_and_json_formats(self):
+        self.assertEqual(
+            self.download("csv").lstrip("\ufeff").splitlines()[1:],
+            ["сахар,г,30", "соль,г,5"]
+        )
+        self.assertEqual(json.loads(self.download("json")), [
+            {"name": "сахар", "measurement_unit": "г", "amount": 30},
+            {"name": "соль", "measurement_unit": "г", "amount": 5},
+        ])
+
+    def test_pdf_format(self):
+        response = self.client.get(self.url, {"format": "pdf"})
+        content = b"".join(response.streaming_content)
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(content.startswith(b"%PDF-"))
+        self.assertTrue(content.endswith(b"%%EOF\n"))
+
+    def test_errors_rendered_as_json(self):
+        response = self.client.get(self.url, {"format": "xml"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.client.force_authenticate(None)
+        for file_format in ("txt", "pdf"):
+            with self.subTest(format=file_format):
+                response = self.client.get(self.url, {"format": file_format})
+                self.assertEqual(response.status_code, 401)
+                self.assertEqual(
+                    response["Content-Type"], "application/json"
+                )
+                self.assertIn("detail", response.json())
+
+    def test_repeated_download_served_from_cache(self):
+        self.download()
+        with self.assertNumQueries(0):
+            self.download("csv")
+
+    @override_settings(SHOPPING_LIST_CACHE_MAX_ROWS=1)
+    def test_long_list_streamed_without_caching(self):
+        self.download()
+        with CaptureQueriesContext(connection) as context:
+            content = self.download()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(
+            content, "Купить в магазине:\nсахар (г) - 30\nсоль (г) - 5"
+        )
+
+    def test_cart_and_recipe_changes_invalidate_cache(self):
+        self.download()
+        ShoppingCart.objects.filter(recipe__name="Рецепт 10").delete()
+        self.assertEqual(
+            self.download(),
+            "Купить в магазине:\nсахар (г) - 20\nсоль (г) - 5"
+        )
+        recipe = Recipe.objects.get(name="Рецепт 20")
+        response = self.client.patch(f"/api/recipes/{recipe.id}/", {
+            "ingredients": [
+                {"id": item.ingredient_id, "amount": 1}
+                for item in recipe.ingredientrecipe.all()
+            ],
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            self.download(),
+            "Купить в магазине:\nсахар (г) - 1\nсоль (г) - 1"
+        )
+
+
+class CatalogResponseCacheTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name="Завтрак", color="#E26C2D", slug="breakfast")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cached_response_and_not_modified(self):
+        response = self.client.get("/api/tags/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/tags/")
+        self.assertEqual(response.json()[0]["slug"], "breakfast")
+        response = self.client.get(
+            "/api/tags/", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_cache_invalidated_on_change(self):
+        etag = self.client.get("/api/tags/")["ETag"]
+        Tag.objects.create(name="Обед", color="#49B64E", slug="lunch")
+        response = self.client.get("/api/tags/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+
+
+class CounterTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("counter")
+        cls.recipe = create_recipe(cls.user)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_counters_follow_changes(self):
+        url = f"/api/recipes/{self.recipe.pk}/favorite/"
+        self.client.post(url)
+        self.client.post(f"/api/recipes/{self.recipe.pk}/shopping_cart/")
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.carts_count, 1)
+        self.client.delete(url)
+        self.recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+        self.assertEqual(self.user.recipes_count, 1)
+
+
+class RecipeRankingTest(APITestCase):
+    url = "/api/recipes/"
+
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users("fan", 3)
+        cls.old, cls.fresh, cls.unused = [
+            create_recipe(users[0], f"Рецепт {i}") for i in range(3)
+        ]
+        for user in users:
+            Favorite.objects.create(user=user, recipe=cls.old)
+        Favorite.objects.filter(recipe=cls.old).update(
+            created_at=timezone.now() - timedelta(days=60)
+        )
+        for user in users[:2]:
+            ShoppingCart.objects.create(user=user, recipe=cls.fresh)
+
+    def setUp(self):
+        cache.clear()
+
+    def ranking(self, ordering):
+        response = self.client.get(self.url, {"ordering": ordering})
+        return [recipe["id"] for recipe in response.json()["results"]]
+
+    def test_popular_and_trending_orderings(self):
+        call_command("refresh_recipe_scores", stdout=StringIO())
+        self.assertEqual(
+            self.ranking("popular"),
+            [self.old.id, self.fresh.id, self.unused.id]
+        )
+        self.assertEqual(
+            self.ranking("trending"),
+            [self.fresh.id, self.old.id, self.unused.id]
+        )
+        response = self.client.get(
+            self.url, {"ordering": "popular", "limit": 2, "cursor": ""}
+        )
+        response = self.client.get(response.json()["next"])
+        self.assertEqual(
+            [recipe["id"] for recipe in response.json()["results"]],
+            [self.unused.id]
+        )
+
+    def test_ties_ordered_by_newest_recipe(self):
+        spare = create_recipe(self.old.author, "Рецепт 3")
+        call_command("refresh_recipe_scores", stdout=StringIO())
+        self.assertEqual(
+            self.ranking("popular")[2:], [spare.id, self.unused.id]
+        )
+
+    def test_ordering_served_by_score_indexes(self):
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute("SET LOCAL enable_sort = off")
+        for ordering, index in (("popular", "recipe_score_popular_idx"),
+                                ("trending", "recipe_score_trending_idx")):
+            with self.subTest(ordering=ordering):
+                plan = RecipeFilter(
+                    {"ordering": ordering}, Recipe.objects.all()
+                ).qs.explain()
+                self.assertIn(index, plan)
+                self.assertNotIn(
+                    "Sort" if connection.vendor == "postgresql"
+                    else "TEMP B-TREE",
+                    plan
+                )
+
+
+class RecipeFilterPlanTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_users("planner", 4)
+        cls.tags = [
+            Tag.objects.create(
+                name=f"План {i}", color=f"#10000{i}", slug=f"plan{i}"
+            )
+            for i in range(4)
+        ]
+        for i in range(80):
+            recipe = create_recipe(cls.users[i % 4], f"Рецепт {i}")
+            recipe.tags.set(cls.tags[:i % 4 + 1])
+            if i % 3 == 0:
+                Favorite.objects.create(user=cls.users[0], recipe=recipe)
+            if i % 5 == 0:
+                ShoppingCart.objects.create(user=cls.users[0], recipe=recipe)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def filtered(self, **data):
+        request = RequestFactory().get("/api/recipes/", data)
+        request.user = self.users[0]
+        return RecipeFilter(
+            request.GET, RecipeViewSet.queryset.all(), request=request
+        ).qs
+
+    def assertPlanUses(self, queryset, *indexes):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = queryset.explain()
+        self.assertTrue(any(index in plan for index in indexes), plan)
+
+    def test_tag_filter_uses_through_table_index(self):
+        self.assertPlanUses(
+            self.filtered(tags=["plan0", "plan1"]),
+            "recipes_recipe_tags_recipe_id_tag_id",
+        )
+
+    def test_user_relation_filters_use_unique_indexes(self):
+        for param, constraint, table in (
+            ("is_favorited", "unique_user_recipe_favorite",
+             Favorite._meta.db_table),
+            ("is_in_shopping_cart", "unique_user_shopping_cart",
+             ShoppingCart._meta.db_table),
+        ):
+            with self.subTest(param=param):
+                self.assertPlanUses(
+                    self.filtered(**{param: 1}),
+                    constraint,
+                    f"sqlite_autoindex_{table}",
+                )
+
+    def test_author_filter_uses_author_pub_date_index(self):
+        self.assertPlanUses(
+            self.filtered(author=self.users[1].id),
+            "recipe_author_pub_date_idx",
+        )
+
+    def test_several_tags_do_not_duplicate_recipes(self):
+        self.client.force_authenticate(self.users[0])
+        response = self.client.get("/api/recipes/", {
+            "tags": ["plan0", "plan1", "plan2"], "is_favorited": 1,
+            "limit": 100,
+        })
+        ids = [recipe["id"] for recipe in response.data["results"]]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), response.data["count"])
+        self.assertEqual(len(ids), self.users[0].favorites.count())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeImageTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("photographer")
+        cls.tag = Tag.objects.create(name="Фото", slug="photo")
+        cls.ingredient = Ingredient.objects.create(
+            name="мука", measurement_unit="г"
+        )
+        buffer = BytesIO()
+        Image.new("RGB", (600, 300), "orange").save(buffer, "PNG")
+        cls.image = "data:image/png;base64," + base64.b64encode(
+            buffer.getvalue()
+        ).decode()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def create(self):
+        return self.client.post("/api/recipes/", {
+            "name": "Рецепт", "text": "Описание", "cooking_time": 10,
+            "tags": [self.tag.id], "image": self.image,
+            "ingredients": [{"id": self.ingredient.id, "amount": 1}],
+        }, format="json")
+
+    def test_renditions_replace_original_in_responses(self):
+        response = self.create()
+        self.assertEqual(response.status_code, 201)
+        images = response.json()["images"]
+        self.assertEqual(images["thumbnail"], response.json()["image"])
+        recipe_id = response.json()["id"]
+        generate_renditions(recipe_id)
+        renditions = Recipe.objects.get(pk=recipe_id).image_renditions
+        response = self.client.get(f"/api/recipes/{recipe_id}/")
+        self.assertTrue(
+            response.json()["images"]["card"].endswith(
+                renditions["card"]
+            )
+        )
+        response = self.client.post(f"/api/recipes/{recipe_id}/favorite/")
+        self.assertTrue(
+            response.json()["images"]["thumbnail"].endswith(".webp")
+        )
+
+    def upload(self, **payload):
+        buffer = BytesIO()
+        Image.new("RGB", (600, 300), "orange").save(buffer, "JPEG")
+        return self.client.post("/api/recipes/", {
+            "name": "Рецепт", "text": "Описание", "cooking_time": 10,
+            "tags": [self.tag.id],
+            "image": SimpleUploadedFile("photo.jpg", buffer.getvalue()),
+            "ingredients": json.dumps(
+                [{"id": self.ingredient.id, "amount": 2}]
+            ),
+            **payload,
+        }, format="multipart")
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_multipart_upload(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 201, response.content)
+        recipe = Recipe.objects.get(pk=response.json()["id"])
+        self.assertTrue(recipe.image.name.endswith(".jpg"))
+        self.assertEqual(recipe.ingredientrecipe.get().amount, 2)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/", {"name": "Новое"},
+            format="multipart"
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        response = self.upload(ingredients="[")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ingredients", response.json())
+        with override_settings(IMAGE_MAX_UPLOAD_SIZE=100):
+            response = self.upload()
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("image", response.json())
+
+    def test_size_limits_checked_before_saving(self):
+        for setting in ({"IMAGE_MAX_UPLOAD_SIZE": 100},
+                        {"IMAGE_MAX_PIXELS": 600 * 299}):
+            with self.subTest(**setting), override_settings(**setting):
+                response = self.create()
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("image", response.json())
+        self.assertFalse(Recipe.objects.exists())
+
+
+class CachedTokenAuthenticationTest(APITestCase):
+    url = "/api/users/me/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user("token")
+
+    def setUp(self):
+        cache.clear()
+        response = self.client.post(
+            "/api/auth/token/login/",
+            {"email": "token@foodgram.ru", "password": "pass"},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {response.data['auth_token']}"
+        )
+
+    def test_token_lookup_cached(self):
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse(any(
+            "authtoken_token" in query["sql"]
+            for query in context.captured_queries
+        ))
+
+    def test_logout_invalidates_token(self):
+        self.client.get(self.url)
+        self.client.post("/api/auth/token/logout/")
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deactivation_and_password_change_invalidate_token(self):
+        self.client.get(self.url)
+        self.user.set_password("new")
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class BatchMutationTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = create_users("batch", 2)
+        cls.recipes = [
+            create_recipe(cls.author, f"Рецепт {i}") for i in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def statuses(self, response):
+        self.assertEqual(response.status_code, 200, response.content)
+        return {
+            item["id"]: item["status"] for item in response.json()["results"]
+        }
+
+    def test_cart_batch(self):
+        first, second, third = self.recipes
+        ShoppingCart.objects.create(user=self.user, recipe=first)
+        url = "/api/recipes/shopping_cart/batch/"
+        ids = [first.id, second.id, third.id, second.id, 0x7fffffff]
+        response = self.client.post(url, {"ids": ids}, format="json")
+        self.assertEqual(self.statuses(response), {
+            first.id: "exists", second.id: "added", third.id: "added",
+            0x7fffffff: "not_found",
+        })
+        self.assertEqual(self.user.carts.count(), 3)
+        self.assertEqual(
+            list(Recipe.objects.order_by("id").values_list(
+                "carts_count", flat=True
+            )),
+            [1, 1, 1]
+        )
+        response = self.client.get("/api/recipes/", {"is_in_shopping_cart": 1})
+        self.assertEqual(response.data["count"], 3)
+        response = self.client.delete(
+            url, {"ids": [first.id, second.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {
+            first.id: "removed", second.id: "removed",
+        })
+        response = self.client.delete(url, {"ids": [first.id]}, format="json")
+        self.assertEqual(self.statuses(response), {first.id: "absent"})
+        self.assertEqual(
+            list(self.user.carts.values_list("recipe_id", flat=True)),
+            [third.id]
+        )
+        self.assertEqual(
+            Recipe.objects.get(pk=first.id).carts_count, 0
+        )
+
+    def test_counters_follow_rows_actually_changed(self):
+        first, second, _ = self.recipes
+        url = "/api/recipes/favorite/batch/"
+        # The row of the first recipe is already there when the insert runs.
+        Favorite.objects.create(user=self.user, recipe=first)
+        response = self.client.post(
+            url, {"ids": [first.id, second.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {
+            first.id: "exists", second.id: "added",
+        })
+        Favorite.objects.filter(recipe=second).delete()
+        response = self.client.delete(
+            url, {"ids": [first.id, second.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {
+            first.id: "removed", second.id: "absent",
+        })
+        self.assertEqual(
+            list(Recipe.objects.order_by("id").values_list(
+                "favorites_count", flat=True
+            )),
+            [0, 0, 0]
+        )
+
+    def test_favorite_batch_validation(self):
+        url = "/api/recipes/favorite/batch/"
+        for ids in ([], ["x"], list(range(1, 102))):
+            with self.subTest(size=len(ids)):
+                response = self.client.post(url, {"ids": ids}, format="json")
+                self.assertEqual(response.status_code, 400)
+
+    def test_subscribe_batch(self):
+        url = "/api/users/subscribe/batch/"
+        response = self.client.post(
+            url, {"ids": [self.user.id, self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {
+            self.user.id: "self", self.author.id: "added",
+        })
+        response = self.client.post(
+            url, {"ids": [self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {self.author.id: "exists"})
+        self.assertEqual(self.user.subscriber.count(), 1)
+        response = self.client.delete(
+            url, {"ids": [self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {self.author.id: "removed"})
+        response = self.client.delete(
+            url, {"ids": [self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {self.author.id: "absent"})
+        self.assertFalse(self.user.subscriber.exists())
+
+    def test_subscribe_batch_bumps_flags_only_on_change(self):
+        url = "/api/users/subscribe/batch/"
+        Subscription.objects.create(user=self.user, author=self.author)
+        version = get_version(user_flags_namespace(self.user.id))
+        response = self.client.post(
+            url, {"ids": [self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {self.author.id: "exists"})
+        self.assertEqual(
+            get_version(user_flags_namespace(self.user.id)), version
+        )
+        response = self.client.delete(
+            url, {"ids": [self.author.id]}, format="json"
+        )
+        self.assertEqual(self.statuses(response), {self.author.id: "removed"})
+        self.assertNotEqual(
+            get_version(user_flags_namespace(self.user.id)), version
+        )
+
+
+class SubscribeTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = create_users("follower", 2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe_once(self):
+        url = f"/api/users/{self.author.id}/subscribe/"
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(response.data["is_subscribed"])
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(
+            Subscription.objects.filter(user=self.user).count(), 1
+        )
+        response = self.client.get(f"/api/users/{self.author.id}/")
+        self.assertTrue(response.data["is_subscribed"])
+
+    def test_self_subscription_rejected(self):
+        response = self.client.post(f"/api/users/{self.user.id}/subscribe/")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class SubscriptionListTest(APITestCase):
+    url = "/api/users/subscriptions/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, *cls.authors = create_users("fan", 4)
+        for author in cls.authors:
+            Subscription.objects.create(user=cls.user, author=author)
+            for i in range(4):
+                create_recipe(author, f"Рецепт {i}")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_depend_on_authors(self):
+        for limit in (1, 3):
+            cache.clear()
+            with self.subTest(limit=limit), self.assertNumQueries(3):
+                response = self.client.get(self.url, {"limit": limit})
+            self.assertEqual(len(response.data["results"]), limit)
+
+    def test_page_count_follows_new_subscriptions(self):
+        self.client.get(self.url, {"limit": 1})
+        author = create_user("newcomer")
+        self.client.post(f"/api/users/{author.id}/subscribe/")
+        response = self.client.get(self.url, {"limit": 1, "page": 4})
+        self.assertEqual(response.data["count"], 4)
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]], [author.id]
+        )
+
+    def test_recipes_limit_applies_per_author(self):
+        response = self.client.get(self.url, {"recipes_limit": 2})
+        for author in response.data["results"]:
+            expected = list(Recipe.objects.filter(
+                author_id=author["id"]
+            ).values_list("id", flat=True)[:2])
+            self.assertEqual(
+                [recipe["id"] for recipe in author["recipes"]], expected
+            )
+            self.assertEqual(author["recipes_count"], 4)
+
+    def test_invalid_recipes_limit(self):
+        for recipes_limit in ("abc", -1, 0):
+            with self.subTest(recipes_limit=recipes_limit):
+                response = self.client.get(
+                    self.url, {"recipes_limit": recipes_limit}
+                )
+                self.assertEqual(response.status_code, 400)
+        author = create_user("newcomer")
+        response = self.client.post(
+            f"/api/users/{author.id}/subscribe/?recipes_limit=abc"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(author.subscribing.exists())
+
+
+class RecipeFeedTest(APITestCase):
+    url = "/api/recipes/feed/"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, *cls.authors = create_users("reader", 4)
+        for i in range(12):
+            create_recipe(cls.authors[i % 3], f"Рецепт {i}")
+        for author in cls.authors[:2]:
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def read_feed(self, queries):
+        expected = list(Recipe.objects.filter(
+            author__in=self.authors[:2]
+        ).order_by("-pub_date", "-id").values_list("id", flat=True))
+        ids = []
+        url, params = self.url, {"limit": 3}
+        while url:
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, params)
+            self.assertTrue(all(
+                recipe["author"]["is_subscribed"]
+                for recipe in response.data["results"]
+            ))
+            ids.extend(recipe["id"] for recipe in response.data["results"])
+            url, params = response.data["next"], None
+        self.assertEqual(ids, expected)
+
+    def test_feed_pages_through_followed_authors(self):
+        self.read_feed(queries=4)
+
+    @override_settings(FEED_MERGE_MIN_AUTHORS=2)
+    def test_feed_merges_author_scans(self):
+        self.read_feed(queries=5)
+
+    @override_settings(FEED_MERGE_MIN_AUTHORS=1, FEED_MERGE_MAX_AUTHORS=1)
+    def test_feed_falls_back_above_merge_limit(self):
+        self.read_feed(queries=4)
+
+    def test_feed_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+class RecipeSearchTest(APITestCase):
+    url = "/api/recipes/"
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user("cook")
+        cls.borscht, cls.cabbage, cls.pie = [
+            create_recipe(author, name, text=text)
+            for name, text in (
+                ("Борщ", "Свекла, морковь и капуста"),
+                ("Капуста тушеная", "Капуста и лук"),
+                ("Пирог", "Мука и яблоки"),
+            )
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = self.client.get(self.url, {"search": query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe["id"] for recipe in response.json()["results"]]
+
+    @skipUnless(connection.vendor == "postgresql", "full-text search")
+    def test_matches_ranked_by_relevance(self):
+        self.assertEqual(
+            self.search("капуста"), [self.cabbage.id, self.borscht.id]
+        )
+        self.assertEqual(self.search("яблоки"), [self.pie.id])
+
+    def test_cursor_keeps_rank_order(self):
+        ids = []
+        url, params = self.url, {"search": "капуста", "limit": 1, "cursor": ""}
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe["id"] for recipe in response.json()["results"])
+            url, params = response.json()["next"], None
+        self.assertEqual(ids, self.search("капуста"))
+
+    @skipUnless(connection.vendor == "postgresql", "full-text search")
+    def test_index_follows_changes(self):
+        self.pie.name = "Капуста в тесте"
+        self.pie.save()
+        self.borscht.delete()
+        self.assertEqual(
+            sorted(self.search("капуста")), [self.cabbage.id, self.pie.id]
+        )
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertLessEqual(
+            set(self.search('капуста" OR *')),
+            {self.cabbage.id, self.borscht.id}
+        )
+
+
+class CookableRecipeTest(APITestCase):
+    url = "/api/recipes/cookable/"
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user("cook")
+        cls.egg, cls.milk, cls.flour, cls.sugar = [
+            Ingredient.objects.create(name=name, measurement_unit="г")
+            for name in ("яйца", "молоко", "мука", "сахар")
+        ]
+        cls.omelette, cls.pancakes, cls.cake = [
+            create_recipe(author, name) for name in ("Омлет", "Блины", "Торт")
+        ]
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe, ingredients in (
+                (cls.omelette, (cls.egg, cls.milk)),
+                (cls.pancakes, (cls.egg, cls.milk, cls.flour)),
+                (cls.cake, (cls.egg, cls.flour, cls.sugar)),
+            )
+            for ingredient in ingredients
+        )
+
+    def cookable(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [
+            (recipe["id"], recipe["matched_ingredients"],
+             recipe["missing_ingredients"])
+            for recipe in response.json()["results"]
+        ]
+
+    def test_ranked_by_coverage(self):
+        self.assertEqual(
+            self.cookable({"ingredients": f"{self.egg.id},{self.milk.id}"}),
+            [
+                (self.omelette.id, 2, 0),
+                (self.pancakes.id, 2, 1),
+                (self.cake.id, 1, 2),
+            ]
+        )
+
+    def test_missing_threshold(self):
+        self.assertEqual(
+            self.cookable({
+                "ingredients": [self.flour.id, self.sugar.id],
+                "max_missing": 1,
+            }),
+            [(self.cake.id, 2, 1)]
+        )
+
+    def test_invalid_parameters(self):
+        for params in ({}, {"ingredients": "яйца"},
+                       {"ingredients": self.egg.id, "max_missing": -1}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400)
@@ -1,15 +1,27 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
-from django.db.models import Sum
+from django.http import StreamingHttpResponse
+from django.db.models import OuterRef, Prefetch, Subquery, Sum
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework import viewsets, status
 
+from foodgram.caching import (INGREDIENTS_NAMESPACE, RECIPES_NAMESPACE,
+                              SCORES_NAMESPACE, TAGS_NAMESPACE,
+                              USERS_NAMESPACE, bump_version, get_version,
+                              get_versions, shopping_list_namespace,
+                              user_flags_namespace)
 from api.filters import SearchIngredientFilter, RecipeFilter
+from api.mixins import CachedResponseMixin, ConditionalGetMixin
 from api.pagination import CustomPaginLimitOnPage
+from api.renderers import SHOPPING_LIST_RENDERERS, ShoppingListRenderer
 from users.models import Subscription, User
 from api.permissions import (
     AuthorOrReadOnly,
@@ -17,6 +29,10 @@ from api.permissions import (
 )
 from api.serializers import (
     ShoppingCartSerializer,
+    BatchSerializer,
+    CookableQuerySerializer,
+    CookableRecipeSerializer,
+    SubscriptionQuerySerializer,
     SubscriptionSerializer,
     RecipeCreateSerializer,
     UserSerializerCustom,
@@ -33,6 +49,28 @@ from recipes.models import (
     Recipe,
     Tag
 )
+from recipes.signals import change_counter
+
+
+def get_batch_ids(request):
+    serializer = BatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return list(dict.fromkeys(serializer.validated_data["ids"]))
+
+
+def batch_results(ids, found, existing, adding, own_id=None):
+    results = []
+    for pk in ids:
+        if pk == own_id:
+            result = "self"
+        elif pk not in found:
+            result = "not_found"
+        elif adding:
+            result = "exists" if pk in existing else "added"
+        else:
+            result = "removed" if pk in existing else "absent"
+        results.append({"id": pk, "status": result})
+    return Response({"results": results})
 
 
 class UserViewSetCustom(UserViewSet):
@@ -47,10 +85,17 @@ class UserViewSetCustom(UserViewSet):
         user = request.user
         author = get_object_or_404(User, id=id)
         if request.method == "POST":
-            subscribe = Subscription.objects.create(user=user, author=author)
-            serializer = SubscriptionSerializer(
-                subscribe, context={"request": request}
-            )
+            if user == author:
+                raise ValidationError(
+                    "Вы не можете подписаться на самого себя!"
+                )
+            recipes_limit = self.get_recipes_limit(request)
+            subscribe = Subscription.objects.create_if_absent(user, author)
+            if subscribe is None:
+                raise ValidationError("Вы уже подписаны на этого автора!")
+            serializer = SubscriptionSerializer(subscribe, context={
+                "request": request, "recipes_limit": recipes_limit,
+            })
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         subscription = get_object_or_404(
             Subscription,
@@ -60,62 +105,320 @@ class UserViewSetCustom(UserViewSet):
         subscription.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(detail=False, methods=("POST", "DELETE"),
+            url_path="subscribe/batch")
+    def subscribe_batch(self, request):
+        user = request.user
+        ids = get_batch_ids(request)
+        found = set(User.objects.filter(pk__in=ids).exclude(
+            pk=user.id
+        ).values_list("pk", flat=True))
+        adding = request.method == "POST"
+        # The raw statements skip the signals, so the cache version is
+        # bumped here when any row changed.
+        if adding:
+            changed = Subscription.objects.add_many(user, found)
+            existing = found - changed
+        else:
+            changed = existing = Subscription.objects.remove_many(user, found)
+        if changed:
+            bump_version(user_flags_namespace(user.id))
+        return batch_results(ids, found, existing, adding, own_id=user.id)
+
+    def get_recipes_limit(self, request):
+        params = SubscriptionQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return params.validated_data.get("recipes_limit")
+
+    def get_recipes_preview(self, recipes_limit):
+        recipes = Recipe.objects.defer("search_vector")
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(
+                    author=OuterRef("author")
+                ).values("pk")[:recipes_limit]
+            ))
+        return Prefetch(
+            "author__recipes", queryset=recipes, to_attr="recipes_preview"
+        )
+
+    def get_keyset_ordering(self):
+        return ("id",)
+
+    def get_count_versions(self):
+        if self.action == "subscriptions":
+            return get_versions(user_flags_namespace(self.request.user.id))
+        return get_versions(USERS_NAMESPACE)
+
     @action(detail=False, methods=("GET",))
     def subscriptions(self, request):
         user = request.user
-        queryset = Subscription.objects.filter(user=user)
+        recipes_limit = self.get_recipes_limit(request)
+        queryset = Subscription.objects.filter(
+            user=user
+        ).select_related("author").prefetch_related(
+            self.get_recipes_preview(recipes_limit)
+        ).order_by("id")
         pages = self.paginate_queryset(queryset)
         serializer = SubscriptionSerializer(
             pages,
             many=True,
-            context={"request": request}
+            context={"request": request, "recipes_limit": recipes_limit}
         )
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    queryset = Recipe.objects.select_related("author").defer(
+        "search_vector"
+    ).prefetch_related(
+        Prefetch(
+            "ingredientrecipe",
+            queryset=IngredientRecipe.objects.select_related(
+                "ingredient"
+            ).order_by("-id"),
+        ),
+        Prefetch("tags", queryset=Tag.objects.order_by("id")),
+    )
     serializer_class = RecipeCreateSerializer
     pagination_class = CustomPaginLimitOnPage
     permission_classes = (AuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
+    keyset_actions = ("feed",)
 
-    def get_serializer_class(self):
-        if self.request.method == "GET":
-            return RecipeReadSerializer
-        return RecipeCreateSerializer
+    def get_queryset(self):
+        return super().get_queryset().with_user_flags(self.request.user)
 
-    def create_list_of_products(self, ingredients):
-        list_of_products = ["Купить в магазине:"]
-        for ingredient in ingredients:
-            ingredient_name = ingredient.get("ingredient__name", "")
-            measurement_unit = ingredient.get(
-                "ingredient__measurement_unit", ""
+    def get_keyset_ordering(self):
+        if self.action == "cookable":
+            return None
+        params = self.request.query_params
+        ranking = RecipeFilter.rankings.get(params.get("ordering"))
+        if ranking is not None and self.action != "feed":
+            return (f"-score__{ranking}", "-score__recipe_id")
+        # Search results are ordered by rank, so the cursor carries it too.
+        if params.get("search", "").strip():
+            return ("-search_rank", "-pub_date", "-id")
+        return ("-pub_date", "-id")
+
+    def get_keyset_page(self, queryset, ordering, limit):
+        if self.action == "feed" and ordering == ("-pub_date", "-id"):
+            authors = list(Subscription.objects.filter(
+                user=self.request.user
+            ).order_by().values_list(
+                "author_id", flat=True
+            )[:settings.FEED_MERGE_MAX_AUTHORS + 1])
+            # Past the upper bound the union grows too large to plan, and
+            # the global pub_date index serves the feed well enough.
+            if (settings.FEED_MERGE_MIN_AUTHORS <= len(authors)
+                    <= settings.FEED_MERGE_MAX_AUTHORS):
+                return self.merge_author_feeds(
+                    queryset, authors, ordering, limit
+                )
+        return list(queryset.order_by(*ordering)[:limit])
+
+    def merge_author_feeds(self, queryset, authors, ordering, limit):
+        # Each branch is a short scan of the (author_id, pub_date) index;
+        # the outer ORDER BY merges them and keeps the first page. Branches
+        # are wrapped in derived tables, which lets them keep their own
+        # ORDER BY and LIMIT on every backend.
+        db_connection = connections[queryset.db]
+        quote = db_connection.ops.quote_name
+        branches = []
+        params = []
+        for number, author in enumerate(authors):
+            sql, branch_params = queryset.filter(author_id=author).order_by(
+                *ordering
+            ).values_list("id", "pub_date")[:limit].query.sql_with_params()
+            branches.append(
+                f"SELECT * FROM ({sql}) {quote(f'feed_{number}')}"
             )
-            amount = ingredient.get("amount", "")
-            list_of_products.append(
-                f"{ingredient_name} ({measurement_unit}) - {amount}"
+            params.extend(branch_params)
+        order = ", ".join(
+            f"{quote(field.lstrip('-'))} "
+            f"{'DESC' if field.startswith('-') else 'ASC'}"
+            for field in ordering
+        )
+        with db_connection.cursor() as cursor:
+            cursor.execute(
+                f"{' UNION ALL '.join(branches)} ORDER BY {order} LIMIT %s",
+                [*params, limit]
             )
-        return "\n".join(list_of_products)
+            ids = [row[0] for row in cursor.fetchall()]
+        recipes = queryset.in_bulk(ids)
+        return [recipes[pk] for pk in ids]
+
+    def get_count_versions(self):
+        # Everything that can add or remove rows of a filtered list, so the
+        # cached page count follows the rows it is sliced with.
+        namespaces = [RECIPES_NAMESPACE, SCORES_NAMESPACE, TAGS_NAMESPACE]
+        if self.request.user.is_authenticated:
+            namespaces.append(user_flags_namespace(self.request.user.id))
+        return get_versions(*namespaces)
+
+    def get_etag_versions(self, request):
+        namespaces = [TAGS_NAMESPACE, INGREDIENTS_NAMESPACE, USERS_NAMESPACE]
+        if request.user.is_authenticated:
+            namespaces.append(user_flags_namespace(request.user.id))
+        return get_versions(*namespaces)
+
+    def get_list_etag_parts(self, request):
+        # The page count is cached under the same versions, so one ETag
+        # never stands for two different counts or page slices.
+        return (
+            request.get_full_path(), request.user.id,
+            *self.get_count_versions(),
+            *get_versions(INGREDIENTS_NAMESPACE, USERS_NAMESPACE),
+        )
+
+    def get_object_etag_parts(self, request):
+        pk = self.kwargs[self.lookup_field]
+        if not pk.isdigit():
+            return None
+        updated_at = Recipe.objects.filter(pk=pk).values_list(
+            "updated_at", flat=True
+        ).first()
+        if updated_at is None:
+            return None
+        return (
+            pk, request.user.id, updated_at,
+            *self.get_etag_versions(request),
+        )
+
+    @action(
+        detail=False,
+        methods=("GET",),
+        permission_classes=(IsAuthenticated,),
+    )
+    def feed(self, request):
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            author__in=Subscription.objects.filter(
+                user=request.user
+            ).values("author")
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False, methods=("GET",))
-    def download_shopping_cart(self, request):
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__carts__user=request.user
-        ).order_by("ingredient__name").values(
+    def cookable(self, request):
+        params = CookableQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset()).cookable(
+            params.validated_data["ingredients"],
+            params.validated_data.get("max_missing"),
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def get_serializer_class(self):
+        if self.action == "cookable":
+            return CookableRecipeSerializer
+        if self.request.method == "GET":
+            return RecipeReadSerializer
+        return RecipeCreateSerializer
+
+    def get_shopping_list(self, user):
+        key = "shopping_list:{}:{}:{}".format(
+            user.id,
+            get_version(shopping_list_namespace(user.id)),
+            get_version(INGREDIENTS_NAMESPACE),
+        )
+        ingredients = cache.get(key)
+        if ingredients is not None:
+            return ingredients
+        return self.stream_shopping_list(key, IngredientRecipe.objects.filter(
+            recipe__carts__user=user
+        ).order_by("ingredient__name").values_list(
             "ingredient__name",
             "ingredient__measurement_unit"
-        ).annotate(amount=Sum('amount'))
-        carts_content = self.create_list_of_products(ingredients)
-        file_name = "list_of_products.txt"
-        response = HttpResponse(
-            carts_content,
-            content_type='text/plain'
+        ).annotate(amount=Sum('amount')))
+
+    def stream_shopping_list(self, key, rows):
+        # Rows are streamed from the database cursor as before. Lists of up
+        # to SHOPPING_LIST_CACHE_MAX_ROWS rows are collected on the way and
+        # cached once fully sent, longer ones are never held in memory.
+        cached = []
+        for row in rows.iterator():
+            if cached is not None:
+                cached.append(row)
+                if len(cached) > settings.SHOPPING_LIST_CACHE_MAX_ROWS:
+                    cached = None
+            yield row
+        if cached is not None:
+            cache.set(key, cached, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+    @action(
+        detail=False,
+        methods=("GET",),
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+    )
+    def download_shopping_cart(self, request):
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(self.get_shopping_list(request.user)),
+            content_type=renderer.media_type
         )
+        if renderer.charset:
+            response["Content-Type"] += f"; charset={renderer.charset}"
+        file_name = f"list_of_products.{renderer.format}"
         response["Content-Disposition"] = f'attachment; filename="{file_name}"'
         return response
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        # Shopping list renderers only stream the list, errors stay JSON.
+        if isinstance(getattr(response, "accepted_renderer", None),
+                      ShoppingListRenderer):
+            response.accepted_renderer = JSONRenderer()
+            response.accepted_media_type = JSONRenderer.media_type
+        return response
+
+    def apply_batch(self, request, model, counter, namespaces):
+        user = request.user
+        ids = get_batch_ids(request)
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            "pk", flat=True
+        ))
+        adding = request.method == "POST"
+        # The raw statements skip the signals that maintain counters and
+        # cache versions, so both are updated here for the changed rows.
+        with transaction.atomic():
+            if adding:
+                changed = model.objects.add_many(user, found)
+                existing = found - changed
+            else:
+                changed = existing = model.objects.remove_many(user, found)
+            change_counter(
+                Recipe.objects.filter(pk__in=changed), counter,
+                1 if adding else -1
+            )
+        if changed:
+            bump_version(*namespaces)
+        return batch_results(ids, found, existing, adding)
+
+    @action(detail=False, methods=("POST", "DELETE"),
+            url_path="favorite/batch")
+    def favorite_batch(self, request):
+        return self.apply_batch(
+            request, Favorite, "favorites_count",
+            (user_flags_namespace(request.user.id),),
+        )
+
+    @action(detail=False, methods=("POST", "DELETE"),
+            url_path="shopping_cart/batch")
+    def shopping_cart_batch(self, request):
+        return self.apply_batch(
+            request, ShoppingCart, "carts_count",
+            (user_flags_namespace(request.user.id),
+             shopping_list_namespace(request.user.id)),
+        )
+
     @action(detail=True, methods=("POST",))
     def shopping_cart(self, request, pk):
         recipe = get_object_or_404(Recipe, id=pk)
@@ -158,15 +461,17 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = TagSerializer
     queryset = Tag.objects.all()
     permission_classes = (AdminOrReadOnly,)
+    cache_namespace = TAGS_NAMESPACE
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     serializer_class = IngredientSerializer
     queryset = Ingredient.objects.all()
     permission_classes = (AdminOrReadOnly,)
+    cache_namespace = INGREDIENTS_NAMESPACE
     filter_backends = (SearchIngredientFilter,)
-    search_fields = ("^name",)
+    autocomplete_limit = 20
@@ -0,0 +1,54 @@
+from hashlib import sha256
+from uuid import uuid4
+
+from django.core.cache import cache
+
+VERSION_KEY = "version:{}"
+TOKEN_KEY = "auth_token:{}"
+INGREDIENTS_NAMESPACE = "ingredients"
+TAGS_NAMESPACE = "tags"
+USERS_NAMESPACE = "users"
+RECIPES_NAMESPACE = "recipes"
+SCORES_NAMESPACE = "recipe_scores"
+
+
+def get_versions(*namespaces):
+    keys = [VERSION_KEY.format(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, uuid4().hex, timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_version(namespace):
+    return get_versions(namespace)[0]
+
+
+def bump_version(*namespaces):
+    cache.set_many(
+        {VERSION_KEY.format(namespace): uuid4().hex
+         for namespace in namespaces},
+        timeout=None,
+    )
+
+
+def shopping_list_namespace(user_id):
+    return f"shopping_list:{user_id}"
+
+
+def user_flags_namespace(user_id):
+    return f"user_flags:{user_id}"
+
+
+def invalidate_shopping_lists(user_ids):
+    bump_version(*map(shopping_list_namespace, user_ids))
+
+
+def token_cache_key(key):
+    return TOKEN_KEY.format(sha256(key.encode("utf-8")).hexdigest())
+
+
+def invalidate_tokens(keys):
+    cache.delete_many([token_cache_key(key) for key in keys])
@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'recipes.apps.RecipesConfig',
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
@@ -78,6 +79,55 @@ DATABASES = {
 }
 
 
+# Cache
+# Cache versions are used to invalidate in-process data, so deployments with
+# several workers need a shared backend (FileBasedCache, memcached).
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', default='foodgram'),
+    }
+}
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Longer shopping lists are streamed from the database without caching.
+SHOPPING_LIST_CACHE_MAX_ROWS = 500
+
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+AUTH_TOKEN_CACHE_TIMEOUT = 60 * 5
+
+# Seconds between checks of the shared ingredients version by the in-memory
+# autocomplete index of each process.
+INGREDIENT_INDEX_CHECK_INTERVAL = 5
+
+# Maximum number of ids accepted by the batch endpoints.
+BATCH_MAX_SIZE = 100
+
+# From this many followed authors on, the feed merges per-author index scans
+# instead of filtering the global pub_date order by subscriptions. Above the
+# maximum the merged query would have too many branches.
+FEED_MERGE_MIN_AUTHORS = 50
+
+FEED_MERGE_MAX_AUTHORS = 500
+
+# Page counts are cached per query and cache versions of the view. Above the
+# threshold the PostgreSQL planner estimate is used instead of an exact COUNT
+# (0 disables).
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
+
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = int(
+    os.getenv('PAGINATION_COUNT_ESTIMATE_THRESHOLD', default=0)
+)
+
+# Recipe ranking
+# Weight of a favorite or cart add in the trending score halves every
+# TRENDING_HALF_LIFE seconds.
+TRENDING_HALF_LIFE = 60 * 60 * 24 * 7
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -101,7 +151,7 @@ REST_FRAMEWORK = {
         "rest_framework.permissions.AllowAny",
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -145,6 +195,29 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = MEDIA_ROOT = BASE_DIR / 'media'
 
+# Recipe images
+# Uploads are re-encoded into renditions that fit the given boxes. Base64
+# bodies are a third larger than the decoded image, hence the body limit.
+IMAGE_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', default='WEBP')
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', default=80))
+IMAGE_MAX_UPLOAD_SIZE = 5 * 1024 * 1024
+IMAGE_MAX_PIXELS = 4096 * 4096
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', default=2))
+
+DATA_UPLOAD_MAX_MEMORY_SIZE = IMAGE_MAX_UPLOAD_SIZE * 4 // 3 + 1024 * 1024
+
+# Multipart uploads above this size are spooled to FILE_UPLOAD_TEMP_DIR
+# instead of being kept in worker memory.
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(
+    os.getenv('FILE_UPLOAD_MAX_MEMORY_SIZE', default=512 * 1024)
+)
+FILE_UPLOAD_TEMP_DIR = os.getenv('FILE_UPLOAD_TEMP_DIR')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
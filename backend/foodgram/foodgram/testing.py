@@ -0,0 +1,24 @@
+from recipes.models import Recipe
+from users.models import User
+
+
+def create_user(username, **fields):
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@foodgram.ru",
+        first_name=username.capitalize(),
+        last_name=username.capitalize(),
+        password="pass",
+        **fields
+    )
+
+
+def create_users(prefix, count):
+    return [create_user(f"{prefix}{i}") for i in range(count)]
+
+
+def create_recipe(author, name="Рецепт", **fields):
+    fields.setdefault("image", "recipes/test.png")
+    fields.setdefault("text", "Описание")
+    fields.setdefault("cooking_time", 10)
+    return Recipe.objects.create(author=author, name=name, **fields)
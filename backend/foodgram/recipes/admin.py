@@ -24,11 +24,12 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ('pk', 'name', 'author', 'in_favorites')
     readonly_fields = ('in_favorites',)
     list_filter = ('name', 'author', 'tags')
+    list_select_related = ('author',)
     empty_value_display = '-пусто-'
 
-    @admin.display(description='В избранном')
+    @admin.display(description='В избранном', ordering='favorites_count')
     def in_favorites(self, obj):
-        return obj.favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(IngredientRecipe)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.renditions import generate_renditions, renditions_are_current
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные версии изображений рецептов."
+
+    def handle(self, *args, **options):
+        processed = 0
+        recipes = Recipe.objects.exclude(image="").only(
+            "image", "image_renditions"
+        )
+        for recipe in recipes.iterator():
+            if not renditions_are_current(recipe):
+                generate_renditions(recipe.pk)
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f"Обработано изображений: {processed}."
+        ))
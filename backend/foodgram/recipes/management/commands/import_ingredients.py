@@ -1,25 +1,120 @@
 import csv
+import json
+import re
+from itertools import islice
+from pathlib import Path
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 
+from foodgram.caching import INGREDIENTS_NAMESPACE, bump_version
 from recipes.models import Ingredient
 
+CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = re.compile(r"[\s,]*")
+CSV_HEADER = ["name", "measurement_unit"]
+
 
 class Command(BaseCommand):
-    def handle(self, *args, **kwargs):
-        if Ingredient.objects.exists():
-            self.stdout.write("Данные были загружены ранее.")
-            return
-        path_csv = "data/ingredients.csv"
-        self._import_ingredients(path_csv)
-        self.stdout.write("Данные успешно загружены.")
-
-    def _import_ingredients(self, path_csv):
-        with open(path_csv, encoding="utf-8") as csvfile:
-            reader_csv = csv.reader(csvfile)
-            next(reader_csv)
-            for row in reader_csv:
-                Ingredient.objects.create(
-                    name=row[0],
-                    measurement_unit=row[1]
+    help = "Загружает ингредиенты из CSV или JSON файла."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            nargs="?",
+            default=settings.BASE_DIR / "data" / "ingredients.csv",
+            help="Путь к файлу .csv или .json.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество строк в одном INSERT.",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="Удалить ингредиенты, которых нет в файле "
+                 "и которые не используются в рецептах.",
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("Размер пачки должен быть больше нуля.")
+        if path.suffix not in (".csv", ".json"):
+            raise CommandError("Поддерживаются только файлы .csv и .json.")
+        seen = set() if options["sync"] else None
+        before = Ingredient.objects.count()
+        total = 0
+        with open(path, encoding="utf-8") as file:
+            rows = (
+                self._read_json(file) if path.suffix == ".json"
+                else self._read_csv(file)
+            )
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                total += len(batch)
+                if seen is not None:
+                    seen.update(batch)
+                Ingredient.objects.bulk_create(
+                    (
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in batch
+                    ),
+                    batch_size=batch_size,
+                    ignore_conflicts=True,
                 )
+        bump_version(INGREDIENTS_NAMESPACE)
+        inserted = Ingredient.objects.count() - before
+        message = (
+            f"Данные загружены. Добавлено: {inserted}, "
+            f"пропущено: {total - inserted}"
+        )
+        if seen is not None:
+            message += f", удалено: {self._sync(seen, batch_size)}"
+        self.stdout.write(self.style.SUCCESS(message + "."))
+
+    def _read_csv(self, file):
+        for row in csv.reader(file):
+            if not row or row == CSV_HEADER:
+                continue
+            yield row[0], row[1]
+
+    def _read_json(self, file):
+        decoder = json.JSONDecoder()
+        buffer = file.read(CHUNK_SIZE).lstrip()
+        if not buffer.startswith("["):
+            raise CommandError("Ожидается JSON-массив ингредиентов.")
+        position = 1
+        while True:
+            position = JSON_SEPARATORS.match(buffer, position).end()
+            if buffer.startswith("]", position):
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    raise CommandError("Файл с ингредиентами повреждён.")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield item["name"], item["measurement_unit"]
+
+    def _sync(self, seen, batch_size):
+        stale = [
+            pk for pk, name, unit in Ingredient.objects.filter(
+                ingredientrecipe__isnull=True
+            ).values_list("pk", "name", "measurement_unit").iterator()
+            if (name, unit) not in seen
+        ]
+        deleted = 0
+        for start in range(0, len(stale), batch_size):
+            deleted += Ingredient.objects.filter(
+                pk__in=stale[start:start + batch_size]
+            ).delete()[0]
+        return deleted
@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import User
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef("pk")}).order_by().values(
+            field
+        ).annotate(total=Count("pk")).values("total")
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ("Сверяет счётчики избранного, корзин и рецептов "
+            "с фактическими данными и исправляет расхождения.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Количество строк, проверяемых за один запрос.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("Размер пачки должен быть больше нуля.")
+        recipes = self.reconcile(Recipe, {
+            "favorites_count": (Favorite, "recipe"),
+            "carts_count": (ShoppingCart, "recipe"),
+        }, batch_size)
+        users = self.reconcile(User, {
+            "recipes_count": (Recipe, "author"),
+        }, batch_size)
+        self.stdout.write(self.style.SUCCESS(
+            f"Исправлено рецептов: {recipes}, пользователей: {users}."
+        ))
+
+    def reconcile(self, model, counters, batch_size):
+        expressions = {
+            field: count_related(related, lookup)
+            for field, (related, lookup) in counters.items()
+        }
+        drift = Q()
+        for field in counters:
+            drift |= ~Q(**{field: F(f"actual_{field}")})
+        fixed = 0
+        last_pk = 0
+        while True:
+            pks = list(model.objects.filter(pk__gt=last_pk).order_by(
+                "pk"
+            ).values_list("pk", flat=True)[:batch_size])
+            if not pks:
+                return fixed
+            last_pk = pks[-1]
+            drifted = list(model.objects.filter(pk__in=pks).annotate(**{
+                f"actual_{field}": expression
+                for field, expression in expressions.items()
+            }).filter(drift).values_list("pk", flat=True))
+            if drifted:
+                fixed += model.objects.filter(pk__in=drifted).update(
+                    **expressions
+                )
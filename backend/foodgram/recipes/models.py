@@ -1,5 +1,10 @@
-from django.db import models
-from users.models import User
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connections, models
+from django.db.models import (Case, Count, Exists, ExpressionWrapper, F,
+                              OuterRef, Q, Value, When)
+from django.utils import timezone
+from users.models import Subscription, User
 from django.core.validators import MinValueValidator
 
 
@@ -53,6 +58,73 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            false = Value(False, output_field=models.BooleanField())
+            return self.annotate(
+                is_favorited=false,
+                is_in_shopping_cart=false,
+                author_is_subscribed=false,
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            author_is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef('author')
+                )
+            ),
+        )
+
+    def search(self, query):
+        if connections[self.db].vendor == 'postgresql':
+            search_query = SearchQuery(
+                query, config='russian', search_type='websearch'
+            )
+            return self.filter(search_vector=search_query).annotate(
+                search_rank=SearchRank(F('search_vector'), search_query)
+            )
+        # Other backends are only used for local development and tests,
+        # a plain substring match is enough there.
+        return self.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        ).annotate(search_rank=Case(
+            When(name__icontains=query, then=Value(1.0)),
+            default=Value(0.0),
+            output_field=models.FloatField(),
+        ))
+
+    def cookable(self, ingredient_ids, max_missing=None):
+        ingredient_ids = list(ingredient_ids)
+        queryset = self.filter(Exists(IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk'), ingredient__in=ingredient_ids
+        ))).annotate(
+            ingredients_total=Count('ingredientrecipe'),
+            ingredients_matched=Count(
+                'ingredientrecipe',
+                filter=Q(ingredientrecipe__ingredient__in=ingredient_ids)
+            ),
+        ).annotate(
+            ingredients_missing=(
+                F('ingredients_total') - F('ingredients_matched')
+            ),
+            coverage=ExpressionWrapper(
+                F('ingredients_matched') * 1.0 / F('ingredients_total'),
+                output_field=models.FloatField()
+            ),
+        )
+        if max_missing is not None:
+            queryset = queryset.filter(ingredients_missing__lte=max_missing)
+        return queryset.order_by(
+            '-coverage', 'ingredients_missing', '-pub_date', '-id'
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
@@ -68,6 +140,11 @@ class Recipe(models.Model):
         verbose_name='Изображние',
         upload_to='recipes/'
     )
+    image_renditions = models.JSONField(
+        verbose_name='Версии изображения',
+        default=dict,
+        editable=False
+    )
     text = models.TextField(
         verbose_name='Описание',
     )
@@ -91,9 +168,40 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True
+    )
+    search_vector = SearchVectorField(
+        verbose_name='Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    carts_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в корзину',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ("-pub_date",)
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"],
+                name="recipe_pub_date_id_idx"
+            ),
+            models.Index(
+                fields=["author", "-pub_date"],
+                name="recipe_author_pub_date_idx"
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -122,6 +230,12 @@ class IngredientRecipe(models.Model):
 
     class Meta:
         ordering = ("-id",)
+        indexes = [
+            models.Index(
+                fields=["ingredient", "recipe"],
+                name="ingredientrecipe_lookup_idx"
+            ),
+        ]
         verbose_name = 'Количество ингредиентов в рецепте'
         verbose_name_plural = 'Количество ингредиентов в рецептах'
 
@@ -129,6 +243,49 @@ class IngredientRecipe(models.Model):
         return f'{self.ingredient} ({self.amount})'
 
 
+class UserRecipeQuerySet(models.QuerySet):
+    # Both statements report the rows they actually changed, so rows added
+    # or removed by a concurrent request are not counted twice.
+    def add_many(self, user, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        created_at = self.model._meta.get_field(
+            'created_at'
+        ).get_db_prep_value(timezone.now(), connection)
+        sql = (
+            f'INSERT INTO {quote(self.model._meta.db_table)} '
+            f'({quote("user_id")}, {quote("recipe_id")}, '
+            f'{quote("created_at")}) VALUES '
+            + ', '.join(['(%s, %s, %s)'] * len(recipe_ids))
+            + f' ON CONFLICT DO NOTHING RETURNING {quote("recipe_id")}'
+        )
+        params = []
+        for recipe_id in recipe_ids:
+            params.extend((user.pk, recipe_id, created_at))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    def remove_many(self, user, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return set()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        sql = (
+            f'DELETE FROM {quote(self.model._meta.db_table)} '
+            f'WHERE {quote("user_id")} = %s AND {quote("recipe_id")} IN ('
+            + ', '.join(['%s'] * len(recipe_ids))
+            + f') RETURNING {quote("recipe_id")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *recipe_ids])
+            return {row[0] for row in cursor.fetchall()}
+
+
 class Favorite(models.Model):
     user = models.ForeignKey(
         User,
@@ -142,6 +299,12 @@ class Favorite(models.Model):
         related_name='favorites',
         verbose_name='Избранный рецепт'
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -171,6 +334,12 @@ class ShoppingCart(models.Model):
         related_name='carts',
         verbose_name='Рецепт'
     )
+    created_at = models.DateTimeField(
+        verbose_name='Дата добавления',
+        auto_now_add=True
+    )
+
+    objects = UserRecipeQuerySet.as_manager()
 
     class Meta:
         constraints = [
@@ -185,3 +354,43 @@ class ShoppingCart(models.Model):
     def __str__(self):
         return (f'Пользователь {self.user.username}'
                 f'добавил {self.recipe.name} в корзину!')
+
+
+class RecipeScore(models.Model):
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт'
+    )
+    popularity = models.PositiveIntegerField(
+        verbose_name='Популярность',
+        default=0
+    )
+    trending = models.FloatField(
+        verbose_name='Популярность с затуханием',
+        default=0
+    )
+    refreshed_at = models.DateTimeField(
+        verbose_name='Дата пересчёта',
+        null=True,
+        db_index=True
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['-popularity', '-recipe'],
+                name='recipe_score_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending', '-recipe'],
+                name='recipe_score_trending_idx'
+            ),
+        ]
+        verbose_name = 'Рейтинг рецепта'
+        verbose_name_plural = 'Рейтинги рецептов'
+
+    def __str__(self):
+        return f'{self.recipe} ({self.popularity})'
@@ -0,0 +1,122 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+from threading import Lock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from foodgram.caching import RECIPES_NAMESPACE, bump_version
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {"WEBP": "webp", "JPEG": "jpg", "PNG": "png"}
+
+# Jobs live in memory only. Those lost on a restart are picked up by the
+# generate_image_renditions command, which skips current renditions.
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_WORKERS,
+    thread_name_prefix="renditions",
+)
+queued = set()
+queued_lock = Lock()
+
+
+def renditions_are_current(recipe):
+    return recipe.image_renditions.get("source") == recipe.image.name
+
+
+def schedule_renditions(recipe_id):
+    transaction.on_commit(lambda: submit(recipe_id))
+
+
+def submit(recipe_id):
+    # A job that has not started yet reads the latest image anyway, so one
+    # queued job per recipe is enough.
+    with queued_lock:
+        if recipe_id in queued:
+            return
+        queued.add(recipe_id)
+    executor.submit(generate_renditions, recipe_id)
+
+
+def encode(image, size):
+    rendition = image.copy()
+    rendition.thumbnail(size, Image.LANCZOS)
+    if settings.IMAGE_FORMAT == "JPEG" or rendition.mode not in (
+        "RGB", "RGBA"
+    ):
+        rendition = rendition.convert(
+            "RGB" if settings.IMAGE_FORMAT == "JPEG" else "RGBA"
+        )
+    buffer = BytesIO()
+    rendition.save(
+        buffer, settings.IMAGE_FORMAT, quality=settings.IMAGE_QUALITY
+    )
+    return ContentFile(buffer.getvalue())
+
+
+def delete_renditions(storage, renditions):
+    for name, path in renditions.items():
+        if name != "source":
+            storage.delete(path)
+
+
+def generate_renditions(recipe_id):
+    with queued_lock:
+        queued.discard(recipe_id)
+    close_old_connections()
+    try:
+        recipe = Recipe.objects.only("image", "image_renditions").get(
+            pk=recipe_id
+        )
+        if not recipe.image or renditions_are_current(recipe):
+            return
+        source = recipe.image.name
+        storage = recipe.image.storage
+        stem = PurePosixPath(source).stem
+        extension = EXTENSIONS[settings.IMAGE_FORMAT]
+        renditions = {"source": source}
+        try:
+            with recipe.image.open("rb") as file, Image.open(file) as image:
+                image = ImageOps.exif_transpose(image)
+                for name, size in settings.IMAGE_RENDITIONS.items():
+                    renditions[name] = storage.save(
+                        f"recipes/renditions/{stem}_{name}.{extension}",
+                        encode(image, size),
+                    )
+        except Exception:
+            delete_renditions(storage, renditions)
+            raise
+        with transaction.atomic():
+            current = Recipe.objects.select_for_update().only(
+                "image", "image_renditions"
+            ).filter(pk=recipe_id).first()
+            # A new image may have been uploaded or another job may have
+            # finished meanwhile, then the fresh renditions are discarded.
+            superseded = (
+                current is None or current.image.name != source
+                or renditions_are_current(current)
+            )
+            if not superseded:
+                Recipe.objects.filter(pk=recipe_id).update(
+                    image_renditions=renditions, updated_at=timezone.now()
+                )
+        delete_renditions(
+            storage, renditions if superseded else current.image_renditions
+        )
+        if not superseded:
+            bump_version(RECIPES_NAMESPACE)
+    except Recipe.DoesNotExist:
+        pass
+    except Exception:
+        logger.exception(
+            "Не удалось обработать изображение рецепта %s", recipe_id
+        )
+    finally:
+        close_old_connections()
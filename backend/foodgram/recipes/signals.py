@@ -0,0 +1,65 @@
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+from recipes.renditions import renditions_are_current, schedule_renditions
+from users.models import User
+
+
+def change_counter(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f"{field}__gt": 0})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_added(instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), "favorites_count", 1
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_removed(instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), "favorites_count", -1
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_added(instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id), "carts_count", 1
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_removed(instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id), "carts_count", -1
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_added(instance, created, **kwargs):
+    if created:
+        RecipeScore.objects.create(recipe=instance)
+        change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", 1
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_image_saved(instance, **kwargs):
+    if instance.image and not renditions_are_current(instance):
+        schedule_renditions(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), "recipes_count", -1
+    )
@@ -0,0 +1,141 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from foodgram.testing import create_recipe, create_user, create_users
+from recipes.models import Favorite, Recipe, RecipeScore, ShoppingCart
+from recipes import renditions
+from recipes.renditions import generate_renditions
+from users.models import User
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+class RecountCountersTest(TestCase):
+    def test_recount_fixes_drift(self):
+        user = create_user("counter")
+        recipe = create_recipe(user)
+        Favorite.objects.create(user=user, recipe=recipe)
+        Recipe.objects.update(favorites_count=5, carts_count=2)
+        User.objects.update(recipes_count=0)
+        out = StringIO()
+        call_command("recount_counters", stdout=out)
+        self.assertIn("рецептов: 1, пользователей: 1", out.getvalue())
+        recipe.refresh_from_db()
+        user.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.carts_count, 0)
+        self.assertEqual(user.recipes_count, 1)
+
+
+class RefreshRecipeScoresTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = create_users("fan", 3)
+        cls.old, cls.fresh = [
+            create_recipe(users[0], f"Рецепт {i}") for i in range(2)
+        ]
+        for user in users:
+            Favorite.objects.create(user=user, recipe=cls.old)
+        Favorite.objects.filter(recipe=cls.old).update(
+            created_at=timezone.now() - timedelta(days=60)
+        )
+        for user in users[:2]:
+            ShoppingCart.objects.create(user=user, recipe=cls.fresh)
+
+    def refresh(self):
+        out = StringIO()
+        call_command("refresh_recipe_scores", stdout=out)
+        return out.getvalue()
+
+    def scores(self):
+        return {
+            score.recipe_id: score for score in RecipeScore.objects.all()
+        }
+
+    def test_trending_decays_with_age(self):
+        self.refresh()
+        scores = self.scores()
+        self.assertEqual(scores[self.old.id].popularity, 3)
+        self.assertEqual(scores[self.fresh.id].popularity, 2)
+        self.assertGreater(
+            scores[self.fresh.id].trending, scores[self.old.id].trending
+        )
+
+    def test_refresh_picks_only_changed_recipes(self):
+        self.refresh()
+        Favorite.objects.filter(recipe=self.old).first().delete()
+        Favorite.objects.filter(recipe=self.old).first().delete()
+        self.assertIn("Обновлено рейтингов: 1.", self.refresh())
+        self.assertEqual(self.scores()[self.old.id].popularity, 1)
+        self.assertIn("Обновлено рейтингов: 0.", self.refresh())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RenditionsTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        buffer = BytesIO()
+        Image.new("RGB", (600, 300), "orange").save(buffer, "PNG")
+        path = default_storage.save(
+            "recipes/photo.png", ContentFile(buffer.getvalue())
+        )
+        self.recipe = create_recipe(create_user("photographer"), image=path)
+
+    def test_renditions_resized_and_encoded(self):
+        generate_renditions(self.recipe.id)
+        self.recipe.refresh_from_db()
+        renditions = self.recipe.image_renditions
+        self.assertEqual(renditions["source"], self.recipe.image.name)
+        for name, size in (("thumbnail", (160, 80)), ("card", (480, 240)),
+                           ("full", (600, 300))):
+            with self.subTest(name=name):
+                with default_storage.open(renditions[name]) as file:
+                    with Image.open(file) as image:
+                        self.assertEqual(image.format, "WEBP")
+                        self.assertEqual(image.size, size)
+
+    def test_superseded_renditions_deleted(self):
+        encode = renditions.encode
+
+        def encode_with_concurrent_job(image, size):
+            # Another job for the same image finishes while this one runs.
+            if not encode_with_concurrent_job.called:
+                encode_with_concurrent_job.called = True
+                generate_renditions(self.recipe.id)
+            return encode(image, size)
+
+        encode_with_concurrent_job.called = False
+        with patch.object(renditions, "encode", encode_with_concurrent_job):
+            generate_renditions(self.recipe.id)
+        self.recipe.refresh_from_db()
+        current = {
+            path for name, path in self.recipe.image_renditions.items()
+            if name != "source"
+        }
+        _, files = default_storage.listdir("recipes/renditions")
+        self.assertEqual(
+            {f"recipes/renditions/{name}" for name in files}, current
+        )
+
+    def test_queued_job_submitted_once(self):
+        with patch.object(renditions.executor, "submit") as submit:
+            renditions.submit(self.recipe.id)
+            renditions.submit(self.recipe.id)
+        self.assertEqual(submit.call_count, 1)
+        generate_renditions(self.recipe.id)
+        self.assertNotIn(self.recipe.id, renditions.queued)
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.3 on 2026-10-18 19:36
+
+from django.db import migrations, models
+import django.db.models.expressions
+
+BATCH_SIZE = 1000
+
+
+def remove_duplicates(apps, schema_editor):
+    Subscription = apps.get_model('users', 'Subscription')
+    Subscription.objects.filter(user=models.F('author')).delete()
+    older = Subscription.objects.filter(
+        user=models.OuterRef('user'),
+        author=models.OuterRef('author'),
+        id__lt=models.OuterRef('id'),
+    )
+    while True:
+        ids = list(Subscription.objects.filter(
+            models.Exists(older)
+        ).values_list('id', flat=True)[:BATCH_SIZE])
+        if not ids:
+            break
+        Subscription.objects.filter(id__in=ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.UniqueConstraint(fields=('user', 'author'), name='unique_user_author_subscription'),
+        ),
+        migrations.AddConstraint(
+            model_name='subscription',
+            constraint=models.CheckConstraint(check=models.Q(('user', django.db.models.expressions.F('author')), _negated=True), name='prevent_self_subscription'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connections, models
+from django.db.models.signals import post_save
 
 
 class User(AbstractUser):
@@ -25,6 +26,11 @@ class User(AbstractUser):
         max_length=150,
         verbose_name="Фамилия"
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Количество рецептов",
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ('username',)
@@ -35,6 +41,69 @@ class User(AbstractUser):
         return self.username
 
 
+class SubscriptionQuerySet(models.QuerySet):
+    def create_if_absent(self, user, author):
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        # A single statement instead of check-then-insert: concurrent
+        # requests cannot both pass the check and insert a duplicate.
+        sql = (
+            f'INSERT INTO {quote(self.model._meta.db_table)} '
+            f'({quote("user_id")}, {quote("author_id")}) VALUES (%s, %s) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote("id")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, author.pk])
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        subscription = self.model(pk=row[0], user=user, author=author)
+        subscription._state.adding = False
+        subscription._state.db = self.db
+        post_save.send(
+            sender=self.model, instance=subscription, created=True,
+            update_fields=None, raw=False, using=self.db,
+        )
+        return subscription
+
+    # Like create_if_absent, both statements report the authors whose rows
+    # they actually changed, so concurrent requests are not counted twice.
+    def add_many(self, user, author_ids):
+        author_ids = list(author_ids)
+        if not author_ids:
+            return set()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        sql = (
+            f'INSERT INTO {quote(self.model._meta.db_table)} '
+            f'({quote("user_id")}, {quote("author_id")}) VALUES '
+            + ', '.join(['(%s, %s)'] * len(author_ids))
+            + f' ON CONFLICT DO NOTHING RETURNING {quote("author_id")}'
+        )
+        params = []
+        for author_id in author_ids:
+            params.extend((user.pk, author_id))
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return {row[0] for row in cursor.fetchall()}
+
+    def remove_many(self, user, author_ids):
+        author_ids = list(author_ids)
+        if not author_ids:
+            return set()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        sql = (
+            f'DELETE FROM {quote(self.model._meta.db_table)} '
+            f'WHERE {quote("user_id")} = %s AND {quote("author_id")} IN ('
+            + ', '.join(['%s'] * len(author_ids))
+            + f') RETURNING {quote("author_id")}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *author_ids])
+            return {row[0] for row in cursor.fetchall()}
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(
         User,
@@ -49,7 +118,19 @@ class Subscription(models.Model):
         verbose_name='Автор'
     )
 
+    objects = SubscriptionQuerySet.as_manager()
+
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'],
+                name='unique_user_author_subscription'
+            ),
+            models.CheckConstraint(
+                check=~models.Q(user=models.F('author')),
+                name='prevent_self_subscription'
+            ),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
 
@@ -0,0 +1,38 @@
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from foodgram.testing import create_users
+from users.models import Subscription
+
+
+class SubscriptionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = create_users("subscriber", 2)
+
+    def test_create_if_absent_inserts_once(self):
+        subscription = Subscription.objects.create_if_absent(
+            self.user, self.author
+        )
+        self.assertEqual(subscription, Subscription.objects.get())
+        self.assertIsNone(
+            Subscription.objects.create_if_absent(self.user, self.author)
+        )
+
+    def test_self_subscription_violates_constraint(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Subscription.objects.create(user=self.user, author=self.user)
+
+    def test_add_many_reports_inserted_authors(self):
+        Subscription.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            Subscription.objects.add_many(self.user, [self.author.id]), set()
+        )
+        self.assertEqual(
+            Subscription.objects.remove_many(self.user, [self.author.id]),
+            {self.author.id},
+        )
+        self.assertEqual(
+            Subscription.objects.add_many(self.user, [self.author.id]),
+            {self.author.id},
+        )